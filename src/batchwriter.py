@@ -0,0 +1,110 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: batchwriter.py
+Description:
+    A file object for writing collecting small writes into large blocks
+History:
+    0.1.1 x keeping fout open with closing=False, e.g. for sys.stdout
+    0.1.0 The first version.
+"""
+__version__ = '0.1.1'
+__author__ = 'SpaceLis'
+
+import threading
+import Queue
+
+class BatchWriter(object):
+    """ A file object collecting what is written into blocks of bufsize
+        bytes before writing them to fout in one call.
+        With background=True, the blocks are written by a thread, so that
+        compressing the blocks (e.g. when fout is a GzipFile) overlaps with
+        producing the outputs. Errors in the thread are raised by the next
+        write(), flush() or close().
+        With closing=False, close() only flushes fout, e.g. for sys.stdout
+        which is not opened by the caller.
+    """
+    def __init__(self, fout, bufsize=1 << 20, background=False, closing=True):
+        super(BatchWriter, self).__init__()
+        self.fout = fout
+        self.closing = closing
+        self.bufsize = bufsize
+        self._buf = list()
+        self._size = 0
+        self._error = None
+        self._queue = None
+        if background:
+            self._queue = Queue.Queue(4)
+            self._thread = threading.Thread(target=self._writing)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _writing(self):
+        """ Write the blocks from the queue until None is received
+        """
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self.fout.write(block)
+            except Exception as e:
+                self._error = e
+
+    def _check(self):
+        """ Raise the error from the writing thread
+        """
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_block(self):
+        """ Write the collected data as one block
+        """
+        if not self._buf:
+            return
+        block = ''.join(self._buf)
+        self._buf = list()
+        self._size = 0
+        if self._queue is not None:
+            self._check()
+            self._queue.put(block)
+        else:
+            self.fout.write(block)
+
+    def write(self, data):
+        """ Collect data and write a block if bufsize is reached
+        """
+        self._buf.append(data)
+        self._size += len(data)
+        if self._size >= self.bufsize:
+            self._write_block()
+
+    def flush(self):
+        """ Write the collected data out
+        """
+        self._write_block()
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._check()
+            self._thread = threading.Thread(target=self._writing)
+            self._thread.daemon = True
+            self._thread.start()
+        self.fout.flush()
+
+    def close(self):
+        """ Write the collected data out and close fout, or flush it with
+            closing=False
+        """
+        self._write_block()
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+            self._check()
+        if self.closing:
+            self.fout.close()
+        else:
+            self.fout.flush()
@@ -0,0 +1,307 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: benchmark.py
+Description:
+    Benchmarks of the tools on generated tweet-like line JSON files
+History:
+    0.1.6 + benchmark of DiscreteLabelConverter over the number of bins
+    0.1.5 + benchmark of converting TSV files in rows and in blocks
+    0.1.4 + benchmark of the time converters
+    0.1.3 + benchmark of the compression codecs
+    0.1.2 + benchmark of reading throughput of compressed and plain files
+    0.1.1 + benchmark of random access with line indexes
+    0.1.0 The first version with benchmark of the jrep prefilter.
+"""
+__version__ = '0.1.6'
+__author__ = 'SpaceLis'
+
+import os
+import sys
+import json
+import time
+import random
+import gzip
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+import gzipreader
+import filecodec
+import converter
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+LANGS = ['en', 'nl', 'fr', 'de', 'es', 'ja']
+
+def gen_tweets(path, num, seed=0):
+    """ Generate num tweet-like JSON objects as lines into path
+    """
+    rnd = random.Random(seed)
+    with open(path, 'w') as fout:
+        for i in xrange(num):
+            uid = rnd.randint(1, 100000)
+            tweet = {'id': i,
+                    'created_at': 'Wed Feb %02d %02d:%02d:%02d +0000 2012' % (
+                        i * 30 / 86400 % 28 + 1, i * 30 / 3600 % 24,
+                        i * 30 / 60 % 60, i * 30 % 60),
+                    'lang': rnd.choice(LANGS),
+                    'text': 'tweet number %d from user %d' % (i, uid),
+                    'retweet_count': rnd.randint(0, 1000),
+                    'user': {'id': uid, 'screen_name': 'user%d' % (uid,),
+                        'followers_count': rnd.randint(0, 100000)},
+                    'entities': {'hashtags': [{'text': 'tag%d' % (rnd.randint(0, 50),),
+                        'indices': [0, 6]}], 'urls': [], 'user_mentions': []}}
+            print >> fout, json.dumps(tweet)
+
+def gzip_members(src, dst, linespermember=10000):
+    """ Compress src into dst with one gzip member per linespermember lines,
+        as pigz or bgzip make.
+    """
+    with open(src) as fin, open(dst, 'wb') as fout:
+        lines = list()
+        for line in fin:
+            lines.append(line)
+            if len(lines) == linespermember:
+                _write_member(fout, lines)
+                lines = list()
+        if lines:
+            _write_member(fout, lines)
+
+def _write_member(fout, lines):
+    """ Write lines as one gzip member
+    """
+    member = gzip.GzipFile(fileobj=fout, mode='wb')
+    member.write(''.join(lines))
+    member.close()
+
+def timeit(func, repeat=3):
+    """ Return the best wall time of running func repeat times
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run_tool(tool, argv):
+    """ Run a tool in this directory with its outputs discarded
+    """
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, os.path.join(_HERE, tool)] + argv,
+                stdout=devnull, stderr=devnull)
+
+def report(name, seconds, numline=None):
+    """ Print the time and the throughput of a run
+    """
+    if numline is None:
+        print '%-40s %8.3fs' % (name, seconds)
+    else:
+        print '%-40s %8.3fs %12.0f lines/s' % (name, seconds, numline / seconds)
+
+def bench_prefilter(args, tmpdir):
+    """ Compare selective jrep queries with and without the prefilter
+    """
+    data = os.path.join(tmpdir, 'tweets.ljson')
+    gen_tweets(data, args.num)
+    idset = os.path.join(tmpdir, 'idset')
+    with open(idset, 'w') as fout:
+        for uid in random.Random(1).sample(xrange(1, 100001), 20):
+            print >> fout, uid
+    for cond in ['user.id==4242', 'lang==ja', 'user.id<<' + idset]:
+        for opt in [[], ['--prefilter']]:
+            argv = opt + ['-i', cond, '-f', 'id', data]
+            report(' '.join(argv[:-1]), timeit(lambda: run_tool('jrep.py', argv),
+                args.repeat), args.num)
+
+def bench_index(args, tmpdir):
+    """ Time reading the last record with and without line indexes
+    """
+    data = os.path.join(tmpdir, 'tweets.ljson')
+    gen_tweets(data, args.num)
+    single = os.path.join(tmpdir, 'single.ljson.gz')
+    with open(data, 'rb') as fin:
+        fout = gzip.open(single, 'wb')
+        shutil.copyfileobj(fin, fout)
+        fout.close()
+    multi = os.path.join(tmpdir, 'multi.ljson.gz')
+    gzip_members(data, multi)
+    argv = ['--skip', str(args.num - 1), '-n', '1', '-f', 'id']
+    for src in [data, single, multi]:
+        name = os.path.basename(src)
+        report('%s without index' % (name,), timeit(lambda: run_tool('jrep.py',
+            argv + [src]), args.repeat))
+        run_tool('jrep.py', ['--build-index', src])
+        report('%s with index' % (name,), timeit(lambda: run_tool('jrep.py',
+            argv + [src]), args.repeat))
+        os.remove(src + '.jidx')
+
+def bench_decompress(args, tmpdir):
+    """ Compare the reading throughput of plain and gzip files with the gzip
+        files decompressed in different ways. The prefilter drops all the
+        lines, so the time is mostly spent in reading.
+    """
+    data = os.path.join(tmpdir, 'tweets.ljson')
+    gen_tweets(data, args.num)
+    single = os.path.join(tmpdir, 'single.ljson.gz')
+    with open(data, 'rb') as fin:
+        fout = gzip.open(single, 'wb')
+        shutil.copyfileobj(fin, fout)
+        fout.close()
+    multi = os.path.join(tmpdir, 'multi.ljson.gz')
+    gzip_members(data, multi)
+    run_tool('jrep.py', ['--build-index', multi])
+    argv = ['--prefilter', '-i', 'lang==xx', '-f', 'id']
+    report('plain', timeit(lambda: run_tool('jrep.py', argv + [data]),
+        args.repeat), args.num)
+    options = [['--gzip-threads', '0'], ['--gzip-threads', '1'], ['--gzip-threads', '4']]
+    if gzipreader.find_pigz() is not None:
+        options.append(['--pigz'])
+    for src in [single, multi]:
+        for opt in options:
+            name = '%s %s' % (os.path.basename(src), ' '.join(opt))
+            report(name, timeit(lambda: run_tool('jrep.py', opt + argv + [src]),
+                args.repeat), args.num)
+
+def bench_codecs(args, tmpdir):
+    """ Compare the codecs available by the time of writing with jrep -o,
+        the compressed size and the time of reading with jrep
+    """
+    data = os.path.join(tmpdir, 'tweets.ljson')
+    gen_tweets(data, args.num)
+    argv = ['--prefilter', '-i', 'lang==xx', '-f', 'id']
+    report('plain %d bytes' % (os.path.getsize(data),), timeit(lambda:
+        run_tool('jrep.py', argv + [data]), args.repeat), args.num)
+    for codec in filecodec.CODECS.itervalues():
+        if not codec.available():
+            print '%-40s not available' % (codec.name,)
+            continue
+        src = data + codec.extension
+        report('%s writing' % (codec.name,), timeit(lambda: run_tool('jrep.py',
+            ['-j', '-o', src, data]), args.repeat), args.num)
+        report('%s reading %d bytes' % (codec.name, os.path.getsize(src)),
+                timeit(lambda: run_tool('jrep.py', argv + [src]), args.repeat), args.num)
+
+def gen_twittertimes(num, persecond=10, seed=0):
+    """ Generate num timestamps of tweets in order, about persecond of them
+        in the same second
+    """
+    rnd = random.Random(seed)
+    start = datetime(2012, 2, 1)
+    second = 0
+    times = list()
+    for _ in xrange(num):
+        if rnd.random() < 1.0 / persecond:
+            second += 1
+        times.append((start + timedelta(seconds=second)).strftime('%a %b %d %H:%M:%S +0000 %Y'))
+    return times
+
+def bench_converters(args, tmpdir):
+    """ Compare the time converters labelling by strptime, by the direct
+        parser, and by the direct parser with the cache of labels
+    """
+    times = gen_twittertimes(args.num)
+    names = sorted(name for name in dir(converter) if name.startswith('TT2'))
+    for name in names:
+        fmt = getattr(converter, name).fmt
+        labelers = [('strptime', converter.TwitterTimeConverterFactory(fmt,
+                converter.strptime_twittertime, 0)),
+            ('parser', converter.TwitterTimeConverterFactory(fmt, converter.twittertime, 0)),
+            ('parser+cache', None)]
+        for desc, labeler in labelers:
+            def run():
+                # a new cache for each run
+                label = labeler or converter.TwitterTimeConverterFactory(fmt,
+                        converter.twittertime)
+                for val in times:
+                    label(val)
+            report('%s %s' % (name, desc), timeit(run, args.repeat), args.num)
+
+def bench_convert(args, tmpdir):
+    """ Compare converter.py converting a TSV file of tweet times and retweet
+        counts row by row and in blocks of rows
+    """
+    data = os.path.join(tmpdir, 'tweets.tsv')
+    rnd = random.Random(0)
+    with open(data, 'w') as fout:
+        for i, ttime in enumerate(gen_twittertimes(args.num)):
+            print >> fout, '%d\t%s\t%d' % (i, ttime, rnd.randint(0, 1000))
+    fields = [('days', ['-f', '1:TT2DayConverter']),
+        ('100 bins', ['-f', '2:DiscreteLabelConverter[%s|%s]' % (','.join(str(b)
+            for b in xrange(10, 1000, 10)), ','.join('L%d' % (i,) for i in xrange(100)))]),
+        ('weeks and 3 bins', ['-f', '1:TT2WeekConverter',
+            '-f', '2:DiscreteLabelConverter[10,100|low,mid,high]'])]
+    for desc, argv in fields:
+        for opt in [['--row-mode'], []]:
+            name = '%s %s' % (desc, 'in rows' if opt else 'in blocks')
+            report(name, timeit(lambda: run_tool('converter.py', opt + argv + [data]),
+                args.repeat), args.num)
+
+def _linear_label(labeler, val):
+    """ Label val by scanning the bins of a DiscreteLabelConverter, as the
+        converter did before binary search
+    """
+    val = float(val)
+    for label, floor in zip(labeler._labels[:-1], labeler._bins):
+        if val <= floor:
+            return label
+    return labeler._labels[-1]
+
+def bench_bins(args, tmpdir):
+    """ Compare DiscreteLabelConverter labelling integer tokens by scanning
+        the bins, by binary search, by the lookup table of integers and in
+        batches, over the number of bins
+    """
+    rnd = random.Random(0)
+    vals = [str(rnd.randint(0, 10000)) for _ in xrange(args.num)]
+    for nbins in [4, 16, 64, 256, 1024]:
+        para = '%s|%s' % (','.join(str(10000 * (i + 1) / nbins) for i in xrange(nbins)),
+                ','.join('L%d' % (i,) for i in xrange(nbins + 1)))
+        labeler = converter.DiscreteLabelConverter(para)
+        lutlabeler = converter.DiscreteLabelConverter(para + '|int')
+        runs = [('scan', lambda: [_linear_label(labeler, val) for val in vals]),
+            ('bisect', lambda: [labeler(val) for val in vals]),
+            ('table', lambda: [lutlabeler(val) for val in vals]),
+            ('batch', lambda: labeler.batch(vals))]
+        for desc, run in runs:
+            report('%d bins %s' % (nbins, desc), timeit(run, args.repeat), args.num)
+
+BENCHMARKS = {'prefilter': bench_prefilter, 'index': bench_index,
+        'decompress': bench_decompress, 'codecs': bench_codecs,
+        'converters': bench_converters, 'convert': bench_convert,
+        'bins': bench_bins}
+
+def parse_parameter():
+    """ Parse the arguments
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks of the tools on '
+            'generated tweet-like line JSON files.')
+    parser.add_argument('-n', '--num', dest='num', action='store', type=int,
+            default=200000, help='The number of generated JSON objects.')
+    parser.add_argument('-r', '--repeat', dest='repeat', action='store', type=int,
+            default=3, help='Report the best time of NUM runs.')
+    parser.add_argument('benchmarks', metavar='NAME', nargs='*',
+            choices=sorted(BENCHMARKS.keys()) + [[]],
+            help='Benchmarks to run: ' + ', '.join(sorted(BENCHMARKS.keys())) +
+            '. All of them if none is given.')
+    return parser.parse_args()
+
+def main():
+    """ main()
+    """
+    args = parse_parameter()
+    tmpdir = tempfile.mkdtemp(prefix='jtoolbench')
+    try:
+        for name in args.benchmarks or sorted(BENCHMARKS.keys()):
+            print '== %s ==' % (name,)
+            BENCHMARKS[name](args, tmpdir)
+    finally:
+        for fname in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, fname))
+        os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: checkpoint.py
+Description:
+    Checkpoints of long scans, for continuing a scan stopped by a failure
+    from where it was saved instead of from the beginning.
+    A checkpoint is a pickled dict replacing the checkpoint file atomically,
+    so that a failure while saving leaves the previous checkpoint. The
+    output file is cut at every checkpoint and truncated to the cut when
+    the scan continues, so that the outputs are the same as those of an
+    uninterrupted scan. Gzip outputs start a new gzip member at every cut,
+    so that the file up to a cut is a complete gzip file.
+History:
+    0.1.1 x raising IOError for corrupted checkpoint files
+    0.1.0 The first version.
+"""
+__version__ = '0.1.1'
+__author__ = 'SpaceLis'
+
+import os
+import time
+import gzip
+import cPickle as pickle
+
+DEFAULT_INTERVAL = 5.0
+_VERSION = 1
+
+
+class Checkpoint(object):
+    """ The checkpoint file of a scan, saved at most every interval seconds
+    """
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        super(Checkpoint, self).__init__()
+        self.path = path
+        self.interval = interval
+        self._last = time.time()
+
+    def load(self):
+        """ Return the state saved, or None if there is no checkpoint
+            Raise IOError if the checkpoint can not be read.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as fin:
+            try:
+                state = pickle.load(fin)
+            except (EOFError, ValueError, pickle.UnpicklingError) as e:
+                raise IOError('Corrupted checkpoint %s: %s' % (self.path, e))
+        if not isinstance(state, dict) or state.get('version') != _VERSION:
+            raise IOError('Unknown checkpoint format of %s' % (self.path,))
+        return state
+
+    def due(self):
+        """ Whether interval seconds have passed since the last save
+        """
+        return time.time() - self._last >= self.interval
+
+    def save(self, state):
+        """ Save the state by replacing the checkpoint file
+        """
+        state = dict(state, version=_VERSION)
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'wb') as fout:
+            pickle.dump(state, fout, pickle.HIGHEST_PROTOCOL)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.rename(tmppath, self.path)
+        self._last = time.time()
+
+    def remove(self):
+        """ Remove the checkpoint once the scan is finished
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResumableOutput(object):
+    """ A plain or gzip output file which can be cut at checkpoints
+        With size given, the file is truncated to size, i.e. a cut, and the
+        outputs are appended.
+    """
+    def __init__(self, path, size=None):
+        super(ResumableOutput, self).__init__()
+        self.path = path
+        if size is None:
+            self._raw = open(path, 'wb')
+        else:
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                raise IOError('Output %s is shorter than at the checkpoint' % (path,))
+            self._raw = open(path, 'r+b')
+            self._raw.truncate(size)
+            self._raw.seek(size)
+        self._gzip = path.endswith('.gz')
+        self._fout = self._open_member() if self._gzip else self._raw
+
+    def _open_member(self):
+        """ Start a new gzip member
+        """
+        return gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    def write(self, data):
+        """ Write data
+        """
+        self._fout.write(data)
+
+    def flush(self):
+        """ Flush the data written
+        """
+        self._fout.flush()
+
+    def cut(self):
+        """ Make the data written a complete file and return its size
+        """
+        if self._gzip:
+            self._fout.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        size = self._raw.tell()
+        if self._gzip:
+            self._fout = self._open_member()
+        return size
+
+    def close(self):
+        """ Close the file
+        """
+        if self._gzip:
+            self._fout.close()
+        self._raw.close()
@@ -0,0 +1,121 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: columnar.py
+Description:
+    Writing the extracted fields to Parquet or Arrow IPC files with pyarrow
+    The rows are collected into columns and written in row groups (record
+    batches for Arrow) of a given number of rows, so that the memory used
+    does not grow with the output. The types of the columns are inferred
+    from the first row group. Missing values are written as nulls. Values
+    not fitting the type of their column are written as nulls with a
+    warning.
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import logging
+
+FORMATS = ['parquet', 'arrow']
+EXTENSIONS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+DEFAULT_ROWGROUP = 65536
+
+
+def format_of(path):
+    """ Return the columnar format of a file by its extension, or None
+    """
+    for ext, fmt in EXTENSIONS.iteritems():
+        if path.endswith(ext):
+            return fmt
+    return None
+
+
+class ColumnarWriter(object):
+    """ Write rows of values of the fields to a Parquet or Arrow IPC file
+        Raise ImportError if pyarrow is not installed.
+    """
+    def __init__(self, path, names, fmt='parquet', rowgroup=DEFAULT_ROWGROUP):
+        super(ColumnarWriter, self).__init__()
+        import pyarrow
+        self._pa = pyarrow
+        if fmt == 'parquet':
+            import pyarrow.parquet
+        self.path = path
+        self.names = names
+        self.fmt = fmt
+        self.rowgroup = rowgroup
+        self._columns = [list() for _ in names]
+        self._nrows = 0
+        self._schema = None
+        self._writer = None
+        self._mismatched = set()
+
+    def write_row(self, row):
+        """ Add a row of values, None for missing values
+        """
+        for column, val in zip(self._columns, row):
+            column.append(val)
+        self._nrows += 1
+        if self._nrows >= self.rowgroup:
+            self._write_group()
+
+    def _array(self, i, column):
+        """ Convert a column to an array of the type in the schema
+        """
+        pa = self._pa
+        try:
+            return pa.array(column, type=self._schema.field(i).type)
+        except (pa.ArrowException, TypeError, ValueError, OverflowError):
+            pass
+        values = list()
+        for val in column:
+            try:
+                pa.array([val], type=self._schema.field(i).type)
+                values.append(val)
+            except (pa.ArrowException, TypeError, ValueError, OverflowError):
+                values.append(None)
+        if i not in self._mismatched:
+            self._mismatched.add(i)
+            logging.warn('Values of %s not fitting %s are written as nulls' %
+                    (self.names[i], self._schema.field(i).type))
+        return pa.array(values, type=self._schema.field(i).type)
+
+    def _open(self):
+        """ Infer the schema from the first row group and open the file
+        """
+        pa = self._pa
+        fields = list()
+        for name, column in zip(self.names, self._columns):
+            vtype = pa.array(column).type
+            if vtype == pa.null():
+                # nothing to infer from
+                vtype = pa.string()
+            fields.append(pa.field(name, vtype))
+        self._schema = pa.schema(fields)
+        if self.fmt == 'parquet':
+            self._writer = pa.parquet.ParquetWriter(self.path, self._schema)
+        else:
+            self._writer = pa.RecordBatchFileWriter(self.path, self._schema)
+
+    def _write_group(self):
+        """ Write the rows collected as a row group
+        """
+        if self._writer is None:
+            self._open()
+        if self._nrows == 0:
+            return
+        arrays = [self._array(i, column) for i, column in enumerate(self._columns)]
+        batch = self._pa.RecordBatch.from_arrays(arrays, schema=self._schema)
+        if self.fmt == 'parquet':
+            self._writer.write_table(self._pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self._columns = [list() for _ in self.names]
+        self._nrows = 0
+
+    def close(self):
+        """ Write the rows left and close the file
+        """
+        self._write_group()
+        self._writer.close()
@@ -4,60 +4,194 @@
 Description:
     Manipulate field data.
 History:
+    0.2.7 x reporting the error of the first failing row of a block
+    0.2.6 x the tweet time parser takes no trailing newline, as strptime
+    0.2.5 x printing the rows of a block before a row failing to convert
+    0.2.4 + binning by bisect, the lookup table of integers with |int
+    0.2.3 + converting the fields of blocks of rows in batches
+    0.2.2 + caching the labels of the time converters, parsing the tweet time
+            without strptime
+    0.2.1 + reading lines in batches
     0.2.0 + Introducing parametered converter with parameters from console
     0.1.0 The first version.
 """
-__version__ = '0.1.0'
+__version__ = '0.2.7'
 __author__ = 'SpaceLis'
 
 from datetime import datetime
 import re
+import math
+import bisect
 import logging
 import argparse
-from fileset import FileInputSet
+import itertools
+from fileset import FileInputSet, read_batches
 
 import sys
 __M__ = sys.modules[__name__]
 
 CONVERTERNAME = re.compile(r'(?P<name>.*Converter)(\[(?P<para>.*)\])?$')
+TWITTERTIMEFORMAT = '%b %d %H:%M:%S +0000 %Y'
+TWITTERTIME = re.compile(r'^.{4}(?P<month>[A-Z][a-z]{2}) (?P<day>\d\d) '
+        r'(?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d) \+0000 (?P<year>\d{4})\Z')
+MONTHS = dict((name, i + 1) for i, name in enumerate(['Jan', 'Feb', 'Mar',
+    'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+# the number of the distinct values whose labels are cached by a converter
+CACHESIZE = 1 << 16
+# the number of rows converted in a batch
+BLOCKROWS = 16384
+# the most integers in the lookup table of DiscreteLabelConverter
+LUTSIZE = 1 << 16
 
 class DiscreteLabelConverter(object):
     """ Use a set of numbers to form a serious bin bounded by numbers.
         E.g. bins = [1, 2, 3, 4], label= = ['<1', '1..2', '2..3', '3..4', '>4']
-        The len(labels) should be one more then len(bins). The order is attained
-        for dispatching, be sure they are in chronical order.
+        The len(labels) should be one more then len(bins). The bins should be
+        in ascending order, e.g. DiscreteLabelConverter[1,2,3,4|a,b,c,d,e].
+        With a third part int, e.g. [1,2,3,4|a,b,c,d,e|int], the labels of the
+        integers within the bins are looked up in a table by the tokens.
     """
     def __init__(self, paraline):
         super(DiscreteLabelConverter, self).__init__()
-        self._bins, self._labels = [v.split(',') for v in paraline.split('|')]
+        parts = paraline.split('|')
+        if len(parts) == 3 and parts[2] == 'int':
+            uselut = True
+        elif len(parts) == 2:
+            uselut = False
+        else:
+            raise ValueError('The parameters should be bins|labels or bins|labels|int')
+        self._bins, self._labels = [v.split(',') for v in parts[:2]]
         self._bins = [float(v) for v in self._bins]
         if not len(self._labels) == len(self._bins) + 1:
             raise ValueError('The len(labels) doesn\'t equals to len(bins)+1')
+        if not all(a <= b for a, b in zip(self._bins, self._bins[1:])):
+            raise ValueError('The bins are not in ascending order')
+        self._lut = self._build_lut() if uselut else None
+        try:
+            import numpy
+            self._numpy = numpy
+            self._npbins = numpy.array(self._bins, dtype=numpy.float64)
+        except ImportError:
+            self._numpy = None
+
+    def _build_lut(self):
+        """ Return the labels of the integers from the first bin to the last
+            bin, by the integers and their strings
+        """
+        low, high = int(math.floor(self._bins[0])), int(math.ceil(self._bins[-1]))
+        if high - low + 1 > LUTSIZE:
+            raise ValueError('The bins span more than %d integers for a lookup table' % (LUTSIZE,))
+        lut = dict()
+        for i in xrange(low, high + 1):
+            lut[i] = lut[str(i)] = self._labels[bisect.bisect_left(self._bins, i)]
+        return lut
 
     def __call__(self, val):
         """ return the label for the token
         """
+        if self._lut is not None:
+            label = self._lut.get(val)
+            if label is not None:
+                return label
         # convert the val into the same type
         val = float(val)
-        for label, floor in zip(self._labels[:-1], self._bins):
-            if val <= floor:
-                return label
-        return self._labels[-1]
+        if val != val:
+            # nan is not within any bin
+            return self._labels[-1]
+        return self._labels[bisect.bisect_left(self._bins, val)]
 
-def twittertime(timestr):
-    """ Convert string format of timestamp in tweets to datetime objects
+    def batch(self, vals):
+        """ return the labels for a list of tokens, binned by numpy if it is
+            installed and there is no lookup table
+        """
+        if self._numpy is None or self._lut is not None:
+            return [self(val) for val in vals]
+        vals = self._numpy.array([float(val) for val in vals], dtype=self._numpy.float64)
+        labels = self._labels
+        return [labels[i] for i in self._npbins.searchsorted(vals, side='left').tolist()]
+
+class LRUCache(object):
+    """ Cache the results of func for the last size distinct arguments used
+        The entries are links [prev, next, key, result] of a circular list
+        from the least to the most recently used.
+    """
+    def __init__(self, func, size=CACHESIZE):
+        super(LRUCache, self).__init__()
+        self.func = func
+        self.size = size
+        self._links = dict()
+        self._root = root = list()
+        root[:] = [root, root, None, None]
+
+    def __call__(self, key):
+        """ Return func(key)
+        """
+        root = self._root
+        link = self._links.get(key)
+        if link is not None:
+            prev, nxt, _, result = link
+            prev[1] = nxt
+            nxt[0] = prev
+        else:
+            result = self.func(key)
+            if len(self._links) >= self.size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._links[oldest[2]]
+            link = self._links[key] = [None, None, key, result]
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return result
+
+    def batch(self, keys):
+        """ Return [func(key)] of a list of keys, with func called once for
+            each distinct key
+        """
+        results = dict()
+        for key in keys:
+            if key not in results:
+                results[key] = self(key)
+        return [results[key] for key in keys]
+
+
+def strptime_twittertime(timestr):
+    """ Convert string format of timestamp in tweets to datetime objects by
+        strptime
     """
     try:
-        return datetime.strptime(timestr[4:], '%b %d %H:%M:%S +0000 %Y')
+        return datetime.strptime(timestr[4:], TWITTERTIMEFORMAT)
     except ValueError as e:
         logging.error(e)
         exit(1)
 
+def twittertime(timestr):
+    """ Convert string format of timestamp in tweets to datetime objects
+        The usual layout is parsed directly, others by strptime.
+    """
+    m = TWITTERTIME.match(timestr)
+    if m is not None and m.group('month') in MONTHS:
+        try:
+            return datetime(int(m.group('year')), MONTHS[m.group('month')],
+                    int(m.group('day')), int(m.group('hour')),
+                    int(m.group('minute')), int(m.group('second')))
+        except ValueError:
+            pass
+    return strptime_twittertime(timestr)
+
 
-def TwitterTimeConverterFactory(fmt, converter=lambda x: x):
-    """ Return a labeler according to time format
+def TwitterTimeConverterFactory(fmt, converter=lambda x: x, cachesize=CACHESIZE):
+    """ Return a labeler according to time format, which caches the labels
+        of the last cachesize distinct values unless cachesize is 0. The
+        format is kept as fmt of the labeler.
     """
-    return lambda x: converter(x).strftime(fmt)
+    labeler = lambda x: converter(x).strftime(fmt)
+    if cachesize > 0:
+        labeler = LRUCache(labeler, cachesize)
+    labeler.fmt = fmt
+    return labeler
 
 TT2WeekConverter = TwitterTimeConverterFactory('%Y-%U', twittertime)
 TT2PWeekConverter = TwitterTimeConverterFactory('%A', twittertime)
@@ -94,6 +228,17 @@ class Pipeline(object):
             item = lb(item)
         return item
 
+    def batch(self, items):
+        """ Run a list of items through the pipeline, by the batch() of the
+            converters having one
+        """
+        for lb in self._cv_pipeline:
+            if hasattr(lb, 'batch'):
+                items = lb.batch(items)
+            else:
+                items = [lb(item) for item in items]
+        return items
+
 class FieldProcesser(object):
     """ Preprocess the field data before doing statistics
     """
@@ -115,6 +260,15 @@ class FieldProcesser(object):
             row[f] = self.processer[f](row[f])
         return row
 
+    def process_batch(self, rows):
+        """ Process a block of lines of data, column by column
+        """
+        for f, pipeline in self.processer.iteritems():
+            column = pipeline.batch([row[f] for row in rows])
+            for row, val in itertools.izip(rows, column):
+                row[f] = val
+        return rows
+
 def parse_arg():
     """ Parse the arguments from commandline
     """
@@ -127,6 +281,14 @@ def parse_arg():
             help='Specifying a pipeline should be used on a field.')
     parser.add_argument('-d', '--delimiter', action='store', dest='delimiter',
             default='\t', help='The delimiter of input and output data format.')
+    parser.add_argument('--block-rows', action='store', type=int, default=BLOCKROWS,
+            dest='blockrows', metavar='NUM', help='Convert the fields of NUM '
+            'rows at a time.')
+    parser.add_argument('--row-mode', action='store_true', dest='rowmode', default=False,
+            help='Convert the rows one by one instead of in blocks. Without it, '
+            'a block with a row failing to convert is converted again row by row, '
+            'printing the rows before the first failing one and reporting its '
+            'error as this mode does.')
     parser.add_argument('--debug', action='store_true', dest='debug', default=False,
             help='Run converter in debug mode.')
     parser.add_argument('sources', metavar='file', nargs='*',
@@ -151,10 +313,35 @@ def main():
         field, plname = p.split(':', 1)
         fproc.add_field_converter(int(field), Pipeline(plname.split(':')))
 
-    for line in fin:
-        data = line.strip().split(args.delimiter)
-        ndata = fproc.process(data)
-        print >> sys.stdout, args.delimiter.join(ndata)
+    if args.rowmode:
+        for batch in read_batches(fin):
+            for line in batch:
+                data = line.strip().split(args.delimiter)
+                ndata = fproc.process(data)
+                print >> sys.stdout, args.delimiter.join(ndata)
+        return
+
+    for batch in read_batches(fin):
+        for start in xrange(0, len(batch), args.blockrows):
+            block = batch[start:start + args.blockrows]
+            # the errors of the block are reported by the replay below, as the
+            # block is converted column by column instead of row by row
+            logging.disable(logging.ERROR)
+            try:
+                rows = fproc.process_batch([line.strip().split(args.delimiter)
+                    for line in block])
+            except (Exception, SystemExit):
+                rows = None
+            finally:
+                logging.disable(logging.NOTSET)
+            if rows is None:
+                # print the rows before the first failing one and raise its
+                # error as in row mode
+                for line in block:
+                    ndata = fproc.process(line.strip().split(args.delimiter))
+                    print >> sys.stdout, args.delimiter.join(ndata)
+                continue
+            sys.stdout.write(''.join(args.delimiter.join(row) + '\n' for row in rows))
 
 def test():
     """docstring for test
@@ -0,0 +1,179 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: extcounter.py
+Description:
+    Exact counting of tokens with more distinct tokens than fit in memory.
+    The counts are kept in a dict until its estimated size exceeds the
+    memory budget, then they are spilled to disk: the tokens are sorted,
+    split into partitions by their hashes and appended to a run file of
+    each partition. The runs of a partition are merged into the counts of
+    its tokens in the order of the tokens, partition by partition, which
+    are k-way merged again for the order of all the tokens, or sorted
+    externally by their counts.
+    The runs are written with marshal into a temporary directory, which is
+    removed by close().
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import os
+import sys
+import heapq
+import shutil
+import marshal
+import logging
+import tempfile
+import itertools
+
+DEFAULT_PARTITIONS = 16
+# the estimated size of an entry in a dict besides its key
+_ENTRYSIZE = 100
+
+
+def _write_run(path, items):
+    """ Write the items to a run file
+    """
+    with open(path, 'wb') as fout:
+        for item in items:
+            marshal.dump(item, fout)
+
+def _read_run(path):
+    """ Iterate over the items of a run file
+    """
+    with open(path, 'rb') as fin:
+        while True:
+            try:
+                yield marshal.load(fin)
+            except EOFError:
+                break
+
+def _sum_adjacent(items):
+    """ Sum the counts of the same tokens adjacent in the items (token,
+        count)
+    """
+    for token, group in itertools.groupby(items, key=lambda x: x[0]):
+        yield token, sum(count for _, count in group)
+
+
+class _Descending(object):
+    """ An item compared in the reversed order for heapq.merge()
+    """
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __lt__(self, other):
+        return other.item < self.item
+
+
+class ExternalCounter(object):
+    """ Count tokens exactly within a memory budget in bytes by spilling
+        the counts into the run files of partitions in tmpdir
+    """
+    def __init__(self, budget, tmpdir=None, partitions=DEFAULT_PARTITIONS):
+        super(ExternalCounter, self).__init__()
+        self.budget = budget
+        self.partitions = partitions
+        self._tmpdir = tempfile.mkdtemp(prefix='stats-', dir=tmpdir)
+        self._runs = [list() for _ in xrange(partitions)]
+        self._counts = dict()
+        self._size = 0
+        # the number of entries held in memory when the budget is reached
+        self._maxentries = None
+        self.spills = 0
+
+    def add(self, token, count=1):
+        """ Count a token
+        """
+        if token in self._counts:
+            self._counts[token] += count
+            return
+        self._counts[token] = count
+        self._size += sys.getsizeof(token) + _ENTRYSIZE
+        if self._size > self.budget:
+            self._spill()
+
+    def merge(self, counts):
+        """ Add the counts of a dict, e.g. a Counter
+        """
+        for token, count in counts.iteritems():
+            self.add(token, count)
+
+    def _spill(self):
+        """ Write the counts in memory to the runs of the partitions
+        """
+        if self._maxentries is None:
+            self._maxentries = len(self._counts)
+        parts = [list() for _ in xrange(self.partitions)]
+        for item in self._counts.iteritems():
+            parts[hash(item[0]) % self.partitions].append(item)
+        self._counts = dict()
+        self._size = 0
+        for idx, part in enumerate(parts):
+            if not part:
+                continue
+            part.sort()
+            path = os.path.join(self._tmpdir, 'run-%d-%d' % (idx, self.spills))
+            _write_run(path, part)
+            self._runs[idx].append(path)
+        self.spills += 1
+        logging.debug('Spilled the counts to disk (%d)' % (self.spills,))
+
+    def _iter_partition(self, idx, memitems):
+        """ Iterate over (token, count) of a partition in the order of the
+            tokens
+        """
+        runs = [_read_run(path) for path in self._runs[idx]]
+        return _sum_adjacent(heapq.merge(sorted(memitems), *runs))
+
+    def _iter_partitions(self):
+        """ Return the iterators of the partitions
+        """
+        parts = [list() for _ in xrange(self.partitions)]
+        for item in self._counts.iteritems():
+            parts[hash(item[0]) % self.partitions].append(item)
+        self._counts = dict()
+        return [self._iter_partition(idx, part) for idx, part in enumerate(parts)]
+
+    def iteritems(self):
+        """ Iterate over (token, count) partition by partition
+        """
+        return itertools.chain(*self._iter_partitions())
+
+    def iter_by_token(self):
+        """ Iterate over (token, count) in the order of the tokens
+        """
+        return heapq.merge(*self._iter_partitions())
+
+    def iter_by_count(self):
+        """ Iterate over (token, count) in the descending order of (count,
+            token), sorted externally in runs of the size of the memory
+            budget
+        """
+        maxentries = self._maxentries or max(self.budget // _ENTRYSIZE, 1)
+        items = ((count, token) for token, count in self.iteritems())
+        runs = list()
+        while True:
+            chunk = list(itertools.islice(items, maxentries))
+            if not chunk:
+                break
+            chunk.sort(reverse=True)
+            path = os.path.join(self._tmpdir, 'sorted-%d' % (len(runs),))
+            _write_run(path, chunk)
+            runs.append(path)
+        merged = heapq.merge(*[itertools.imap(_Descending, _read_run(run)) for run in runs])
+        return ((desc.item[1], desc.item[0]) for desc in merged)
+
+    def top_by_count(self, k):
+        """ Return the k items (token, count) of the largest (count, token)
+        """
+        items = heapq.nlargest(k, ((count, token) for token, count in self.iteritems()))
+        return [(token, count) for count, token in items]
+
+    def close(self):
+        """ Remove the run files
+        """
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
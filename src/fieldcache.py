@@ -0,0 +1,328 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: fieldcache.py
+Description:
+    A disk cache of the values of elements of the lines of files, for
+    repeating queries on the same elements of the same files without
+    decoding the JSON lines again.
+    The values of FILE for an element path are stored in one column file in
+    the cache directory, named by a hash of the path, the size and the
+    modification time of FILE and the element path, so that the columns of
+    changed files are never used. A column tells for each line whether the
+    line is malformed (with the error message), has no such element, or has
+    the value. The lines are marshalled in chunks, which are located by a
+    table of offsets at the end of the column and read through mmap.
+    The least recently used columns are removed when the cache is larger
+    than its budget. The modification time of a column is updated whenever
+    it is used.
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import os
+import mmap
+import array
+import struct
+import marshal
+import hashlib
+import itertools
+import logging
+
+DEFAULT_CACHEDIR = os.path.join(os.path.expanduser('~'), '.cache', 'jtool')
+DEFAULT_BUDGET = 1024
+COLUMNSUFFIX = '.jcol'
+CHUNKLINES = 4096
+_MAGIC = 'JCOL'
+_VERSION = 1
+# the offsets are unsigned longs in the native byte order, as the cache is local
+_OFFSETTYPE = 'L'
+_OFFSETSIZE = array.array(_OFFSETTYPE).itemsize
+# magic, version, size of offsets, number of chunks, offset of the offset table
+_HEADER = struct.Struct('<4sIIQQ')
+
+VALUE = 'v'
+MISSING = 'm'
+MALFORMED = 'e'
+
+
+def split_path(path):
+    """ Split an element path into the keys, with list positions (@N) as
+        int, see jrep.Extractor
+    """
+    return [int(elem[1:]) if elem.startswith('@') else elem for elem in path.split('.')]
+
+def cacheable(path):
+    """ Whether the values of an element path can be cached
+    """
+    if path.startswith(':'):
+        return False
+    try:
+        split_path(path)
+    except ValueError:
+        return False
+    return True
+
+
+class ColumnWriter(object):
+    """ Write the entries of a column to a temporary file, which replaces
+        the column file when it is closed
+        The entries are written in chunks of (kinds, data), where kinds is a
+        string of the kinds of the lines.
+    """
+    def __init__(self, path):
+        super(ColumnWriter, self).__init__()
+        self.path = path
+        self._tmppath = path + '.tmp'
+        self._fout = open(self._tmppath, 'wb')
+        self._fout.write(_HEADER.pack(_MAGIC, _VERSION, _OFFSETSIZE, 0, 0))
+        self._offsets = array.array(_OFFSETTYPE, [_HEADER.size])
+        self._kinds = list()
+        self._data = list()
+
+    def add(self, kind, data=None):
+        """ Add the entry of the next line
+        """
+        self._kinds.append(kind)
+        self._data.append(data)
+        if len(self._kinds) >= CHUNKLINES:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        """ Write the entries added as a chunk
+        """
+        chunk = marshal.dumps((''.join(self._kinds), self._data))
+        self._fout.write(chunk)
+        self._offsets.append(self._offsets[-1] + len(chunk))
+        self._kinds = list()
+        self._data = list()
+
+    def close(self):
+        """ Write the offset table and replace the column file
+        """
+        if self._kinds:
+            self._write_chunk()
+        tablepos = self._offsets[-1]
+        self._offsets.tofile(self._fout)
+        self._fout.seek(0)
+        self._fout.write(_HEADER.pack(_MAGIC, _VERSION, _OFFSETSIZE,
+            len(self._offsets) - 1, tablepos))
+        self._fout.close()
+        os.rename(self._tmppath, self.path)
+
+    def abort(self):
+        """ Remove the temporary file
+        """
+        self._fout.close()
+        os.remove(self._tmppath)
+
+
+class ColumnReader(object):
+    """ Read the chunks of a column file, see ColumnWriter
+    """
+    def __init__(self, path):
+        super(ColumnReader, self).__init__()
+        with open(path, 'rb') as fin:
+            self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, offsetsize, nchunks, tablepos = \
+                _HEADER.unpack(self._mm[:_HEADER.size])
+        if magic != _MAGIC or version != _VERSION or offsetsize != _OFFSETSIZE:
+            self._mm.close()
+            raise IOError('Unknown column format of %s' % (path,))
+        self._offsets = array.array(_OFFSETTYPE)
+        self._offsets.fromstring(self._mm[tablepos:tablepos + _OFFSETSIZE * (nchunks + 1)])
+
+    def chunks(self):
+        """ Iterate over the chunks (kinds, data)
+        """
+        mm, offsets = self._mm, self._offsets
+        for i in xrange(len(offsets) - 1):
+            yield marshal.loads(mm[offsets[i]:offsets[i + 1]])
+
+
+    def close(self):
+        """ Unmap the column file
+        """
+        self._mm.close()
+
+
+def iter_entries(readers):
+    """ Iterate over the entries (kind, data) of the columns read by the
+        readers for each line
+    """
+    for chunks in itertools.izip(*[reader.chunks() for reader in readers]):
+        for entries in itertools.izip(*[itertools.izip(kinds, data)
+                for kinds, data in chunks]):
+            yield entries
+
+
+class SparseObjects(object):
+    """ Build objects only having the values of the element paths, on which
+        the paths give the same values as on the original objects
+    """
+    def __init__(self, paths):
+        super(SparseObjects, self).__init__()
+        self.keys = [split_path(path) for path in paths]
+
+    def iter_objects(self, readers):
+        """ Iterate over (object, None) for the lines of a file, or (None,
+            error message) for malformed lines, from the readers of the
+            columns of the paths
+        """
+        for entries in iter_entries(readers):
+            kind, data = entries[0]
+            if kind == MALFORMED:
+                yield None, data
+                continue
+            obj = dict()
+            for keys, (kind, data) in zip(self.keys, entries):
+                if kind != VALUE:
+                    continue
+                node = obj
+                for key in keys[:-1]:
+                    node = node.setdefault(key, dict())
+                node[keys[-1]] = data
+            yield obj, None
+
+
+class FieldCache(object):
+    """ The cache of columns in cachedir with a budget in bytes
+    """
+    def __init__(self, cachedir=DEFAULT_CACHEDIR, budget=DEFAULT_BUDGET << 20):
+        super(FieldCache, self).__init__()
+        self.cachedir = cachedir
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def column_path(self, src, path):
+        """ Return the path of the column of src for the element path
+        """
+        stat = os.stat(src)
+        key = '%s\0%d\0%r\0%s' % (os.path.abspath(src), stat.st_size, stat.st_mtime, path)
+        return os.path.join(self.cachedir, hashlib.sha1(key).hexdigest() + COLUMNSUFFIX)
+
+    def find(self, srcs, paths):
+        """ Return the list of (file, path) whose columns are not cached
+        """
+        missing = list()
+        for src in srcs:
+            for path in paths:
+                if os.path.exists(self.column_path(src, path)):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    missing.append((src, path))
+        return missing
+
+    def open(self, src, path):
+        """ Open the column of src for path and mark it as used
+        """
+        cpath = self.column_path(src, path)
+        os.utime(cpath, None)
+        return ColumnReader(cpath)
+
+    def create(self, src, path):
+        """ Create the column of src for path
+        """
+        return ColumnWriter(self.column_path(src, path))
+
+    def evict(self):
+        """ Remove the least recently used columns until the cache is within
+            its budget
+        """
+        columns = list()
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not name.endswith(COLUMNSUFFIX):
+                continue
+            cpath = os.path.join(self.cachedir, name)
+            stat = os.stat(cpath)
+            columns.append((stat.st_mtime, stat.st_size, cpath))
+            total += stat.st_size
+        columns.sort()
+        for _, size, cpath in columns:
+            if total <= self.budget:
+                break
+            os.remove(cpath)
+            total -= size
+            logging.debug('Removed %s from the field cache' % (cpath,))
+
+    def report(self):
+        """ Log the numbers of the columns found and not found
+        """
+        logging.debug('Field cache: %d hits, %d misses' % (self.hits, self.misses))
+
+
+class FieldCacheBuilder(object):
+    """ Build the columns missing in the cache while the files are read
+        Call add() for each line in the order of reading with the
+        FileInputSet and the decoded object, or None and the error message
+        for malformed lines. The columns of a file are written once the
+        whole file is read.
+    """
+    def __init__(self, cache, missing, parses):
+        super(FieldCacheBuilder, self).__init__()
+        self.cache = cache
+        self.parses = parses
+        self._paths = dict()
+        for src, path in missing:
+            self._paths.setdefault(src, list()).append(path)
+        self._src = None
+        self._fin = None
+        self._writers = list()
+        for src in self._paths.keys():
+            # empty files have no lines telling when they are read
+            if os.path.getsize(src) == 0:
+                self._start(src)
+                self._finish()
+
+    def _start(self, src):
+        """ Start building the columns of src
+        """
+        self._src = src
+        self._writers = [(self.parses[path], self.cache.create(src, path))
+                for path in self._paths.pop(src, ())]
+
+    def _finish(self):
+        """ Write the columns of the current file if it is read without
+            errors
+        """
+        if self._fin is not None and self._src in self._fin.failed:
+            logging.warn('No field cache is built for %s due to errors' % (self._src,))
+            for _, writer in self._writers:
+                writer.abort()
+        else:
+            for _, writer in self._writers:
+                writer.close()
+        self._writers = list()
+        self._src = None
+
+    def add(self, fin, obj, error=None):
+        """ Add the values in obj, a line just read from fin
+        """
+        src = fin.get_current()
+        if src != self._src:
+            self._fin = fin
+            self._finish()
+            self._start(src)
+        for parse, writer in self._writers:
+            if obj is None:
+                writer.add(MALFORMED, error)
+                continue
+            try:
+                writer.add(VALUE, parse(obj))
+            except (KeyError, IndexError, TypeError):
+                writer.add(MISSING)
+
+    def close(self, complete):
+        """ Write the columns of the last file if it is read completely
+        """
+        if complete:
+            self._finish()
+        else:
+            for _, writer in self._writers:
+                writer.abort()
@@ -0,0 +1,263 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: filecodec.py
+Description:
+    The compression formats of line-JSON files for reading and writing,
+    i.e. gzip, bz2, xz, zstd and lz4. The codec of an input file is picked by
+    its extension, or by its magic bytes if the extension is not known. The
+    codec of an output file is picked by its extension.
+    A codec uses its Python module if it is installed, or otherwise its
+    command line tool, e.g. zstd -dc for reading, and is not available if
+    neither is installed. Gzip files are read by gzipreader.py, by default
+    with the gzip module, which reports corrupted members as before.
+    Line indexes, value indexes and zone maps are only built for plain and
+    gzip files.
+History:
+    0.1.1 x gzip files are read with the gzip module unless gzthreads or pigz
+    0.1.0 The first version.
+"""
+__version__ = '0.1.1'
+__author__ = 'SpaceLis'
+
+import os
+import logging
+import importlib
+import subprocess
+import collections
+from distutils.spawn import find_executable
+from gzipreader import BLOCKSIZE, BlockLineReader, command_blocks, open_gzip
+
+MAGICSIZE = 6
+
+
+def _read_blocks(fin):
+    """ Iterate over the blocks read from a file object, which is closed at
+        the end
+    """
+    try:
+        while True:
+            data = fin.read(BLOCKSIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        fin.close()
+
+def _bz2_blocks(module, src):
+    """ Iterate over the decompressed blocks of a bz2 file made of one or
+        more streams, e.g. by pbzip2
+    """
+    with open(src, 'rb') as raw:
+        decomp = module.BZ2Decompressor()
+        started = False
+        while True:
+            buf = raw.read(BLOCKSIZE)
+            if not buf:
+                break
+            while buf:
+                data = decomp.decompress(buf)
+                started = True
+                if data:
+                    yield data
+                buf = decomp.unused_data
+                if buf:
+                    decomp = module.BZ2Decompressor()
+                    started = False
+        if started:
+            try:
+                decomp.decompress('')
+            except EOFError:
+                # the last stream is complete
+                return
+            raise IOError('Truncated bz2 stream')
+
+def _zstd_blocks(module, src):
+    """ Iterate over the decompressed blocks of a zstd file
+    """
+    with open(src, 'rb') as raw:
+        reader = module.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        for data in _read_blocks(reader):
+            yield data
+
+def _lz4_blocks(module, src):
+    """ Iterate over the decompressed blocks of a lz4 frame file
+    """
+    return _read_blocks(module.open(src, 'rb'))
+
+def _xz_blocks(module, src):
+    """ Iterate over the decompressed blocks of a xz file
+    """
+    return _read_blocks(module.open(src, 'rb'))
+
+def _zstd_writer(module, path):
+    """ Open a zstd file for writing
+    """
+    return module.ZstdCompressor().stream_writer(open(path, 'wb'))
+
+
+class CommandWriter(object):
+    """ A file object writing to a file through a compressing command, e.g.
+        zstd -c
+    """
+    def __init__(self, argv, path):
+        super(CommandWriter, self).__init__()
+        self._fout = open(path, 'wb')
+        self._proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=self._fout)
+        self._name = os.path.basename(argv[0])
+
+    def write(self, data):
+        """ Write data to the command
+        """
+        self._proc.stdin.write(data)
+
+    def flush(self):
+        """ Flush the data to the command
+        """
+        self._proc.stdin.flush()
+
+    def close(self):
+        """ Wait for the command to finish and close the file
+        """
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        self._fout.close()
+        if returncode != 0:
+            raise IOError('%s failed to compress %s' % (self._name, self._fout.name))
+
+
+class Codec(object):
+    """ A compression format with its extension, its magic bytes, the Python
+        modules and the command which can read and write it
+        reader(module, path) iterates over the decompressed blocks of a file
+        and writer(module, path) opens a file for writing with the first of
+        the modules installed. errors are the names of the exceptions of the
+        module which are raised as IOError.
+    """
+    def __init__(self, name, extension, magic, modules, reader, writer,
+            errors=(), command=None):
+        super(Codec, self).__init__()
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.modules = modules
+        self.reader = reader
+        self.writer = writer
+        self.errors = errors
+        self.command = command
+        self._module = None
+
+    def module(self):
+        """ Return the first of the modules installed, or None
+        """
+        if self._module is None:
+            for name in self.modules:
+                try:
+                    self._module = importlib.import_module(name)
+                    break
+                except ImportError:
+                    pass
+        return self._module
+
+    def command_path(self):
+        """ Return the path of the command, or None if it is not installed
+        """
+        return find_executable(self.command) if self.command else None
+
+    def available(self):
+        """ Whether the codec can be used
+        """
+        return self.module() is not None or self.command_path() is not None
+
+    def _checked(self, blocks, module):
+        """ Raise the errors of the module from the blocks as IOError
+        """
+        errors = tuple(getattr(module, name) for name in self.errors
+                if hasattr(module, name)) + (EOFError, RuntimeError)
+        try:
+            for data in blocks:
+                yield data
+        except errors as e:
+            raise IOError('%s: %s' % (type(e).__name__, e))
+
+    def open_read(self, src):
+        """ Open a file for reading its lines
+        """
+        module = self.module()
+        if module is not None:
+            return BlockLineReader(self._checked(self.reader(module, src), module))
+        command = self.command_path()
+        if command is not None:
+            return BlockLineReader(command_blocks([command, '-dc'], src))
+        raise IOError('Neither a Python module (%s) nor %s is installed for '
+                'reading %s files' % (', '.join(self.modules), self.command, self.name))
+
+    def open_write(self, path):
+        """ Open a file for writing
+        """
+        module = self.module()
+        if module is not None:
+            return self.writer(module, path)
+        command = self.command_path()
+        if command is not None:
+            return CommandWriter([command, '-c'], path)
+        raise IOError('Neither a Python module (%s) nor %s is installed for '
+                'writing %s files' % (', '.join(self.modules), self.command, self.name))
+
+
+CODECS = collections.OrderedDict((codec.name, codec) for codec in [
+    Codec('gzip', '.gz', '\x1f\x8b', ['gzip'], None,
+        lambda module, path: module.open(path, 'wb')),
+    Codec('bz2', '.bz2', 'BZh', ['bz2'], _bz2_blocks,
+        lambda module, path: module.BZ2File(path, 'w'), command='bzip2'),
+    Codec('xz', '.xz', '\xfd7zXZ\x00', ['lzma', 'backports.lzma'], _xz_blocks,
+        lambda module, path: module.open(path, 'wb'), ('LZMAError',), 'xz'),
+    Codec('zstd', '.zst', '\x28\xb5\x2f\xfd', ['zstandard'], _zstd_blocks,
+        _zstd_writer, ('ZstdError',), 'zstd'),
+    Codec('lz4', '.lz4', '\x04\x22\x4d\x18', ['lz4.frame'], _lz4_blocks,
+        lambda module, path: module.open(path, 'wb'), command='lz4'),
+])
+
+
+def find_codec(path, sniff=True):
+    """ Return the codec of a file by its extension, or by its magic bytes
+        if sniff is True, or None for plain files
+    """
+    for codec in CODECS.itervalues():
+        if path.endswith(codec.extension):
+            return codec
+    if not sniff:
+        return None
+    with open(path, 'rb') as fin:
+        head = fin.read(MAGICSIZE)
+    for codec in CODECS.itervalues():
+        if head.startswith(codec.magic):
+            logging.debug('%s is read as a %s file' % (path, codec.name))
+            return codec
+    return None
+
+def indexable(src):
+    """ Whether the positions of the lines of src can be indexed, i.e. src
+        is a plain file or a gzip file named .gz
+    """
+    return src.endswith('.gz') or find_codec(src) is None
+
+def open_input(src, gzthreads=0, pigz=False):
+    """ Open a plain or compressed file for reading its lines
+        Gzip files, by their extension or magic bytes, are opened by
+        gzipreader.open_gzip() with gzthreads and pigz, i.e. by the gzip
+        module with the defaults.
+    """
+    codec = find_codec(src)
+    if codec is None:
+        return open(src)
+    if codec.name == 'gzip':
+        return open_gzip(src, gzthreads, pigz)
+    return codec.open_read(src)
+
+def open_output(path):
+    """ Open a plain or compressed file for writing by its extension
+    """
+    codec = find_codec(path, sniff=False)
+    if codec is None:
+        return open(path, 'w')
+    return codec.open_write(path)
@@ -4,36 +4,352 @@
 Description:
     A firtual file representing a set of files for reading
 History:
+    0.1.11 x reading terminals and pipes by the bytes arrived so far
+    0.1.10 x warning about the files failed to split instead of raising
+    0.1.9 x keeping the offset of the line seeked by an index in the state
+    0.1.8 + resuming batches from a saved state
+    0.1.7 + reading files compressed by other codecs, see filecodec.py
+    0.1.6 + reading lines in batches split from large blocks
+    0.1.5 + decompressing gzip files in threads or by pigz
+    0.1.4 + tracking the positions of lines for building zone maps
+    0.1.3 + seeking with line indexes for skipping lines and splitting gzip files
+    0.1.2 + closing the files, also when the reading is stopped early
+    0.1.1 + reading byte ranges of plain files split at line boundaries
     0.1.0 The first version.
 """
-__version__ = '0.1.0'
+__version__ = '0.1.11'
 __author__ = 'SpaceLis'
 
+import os
+import stat
 import logging
-import gzip
+import itertools
+from cStringIO import StringIO
+from lineindex import LineIndex, LineRange, iter_blocks, iter_lines
+from gzipreader import BlockLineReader
+from filecodec import find_codec, indexable, open_input
+
+BATCHSIZE = 4 << 20
+# the number of lines in a batch made from an iterator of lines
+BATCHLINES = 4096
+
+
+def split_ranges(src, chunksize):
+    """ Split a plain file into byte ranges of about chunksize bytes.
+        Each boundary is moved forward to the start of the next line, so that
+        every line belongs to exactly one range. Returns a list of
+        (src, start, end) which can be used as sources of FileInputSet.
+    """
+    size = os.path.getsize(src)
+    ranges = list()
+    with open(src, 'rb') as fin:
+        start = 0
+        while start < size:
+            end = start + chunksize
+            if end >= size:
+                end = size
+            else:
+                fin.seek(end - 1)
+                fin.readline()
+                end = fin.tell()
+            ranges.append((src, start, end))
+            start = end
+    return ranges
+
+def split_sources(srcs, chunksize):
+    """ Split the plain files in srcs into ranges of about chunksize bytes.
+        Gzip files are split into LineRanges by their line indexes, or kept
+        as a whole if they are not indexed, as other compressed files.
+        The files failed with OSError or IOError are warned about and left out.
+    """
+    ranges = list()
+    for src in srcs:
+        try:
+            size = os.path.getsize(src)
+            codec = find_codec(src)
+        except (OSError, IOError) as e:
+            logging.warn('%s at %s' % (e, src))
+            continue
+        if size <= chunksize or (codec is not None and not indexable(src)):
+            ranges.append(src)
+        elif codec is not None:
+            index = LineIndex.load(src)
+            if index is None:
+                ranges.append(src)
+            else:
+                ranges.extend(index.split((size + chunksize - 1) // chunksize))
+        else:
+            ranges.extend(split_ranges(src, chunksize))
+    return ranges
+
+def iter_range(fin, start, end):
+    """ Iterate over the lines of fin in the byte range [start, end)
+    """
+    fin.seek(start)
+    pos = start
+    while pos < end:
+        line = fin.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+def _split_blocks(blocks):
+    """ Split the blocks into lists of lines
+    """
+    part = ''
+    for block in blocks:
+        lines = StringIO(block).readlines()
+        if not lines:
+            continue
+        if part:
+            lines[0] = part + lines[0]
+        part = lines.pop() if not lines[-1].endswith('\n') else ''
+        if lines:
+            yield lines
+    if part:
+        yield [part]
+
+def _read_blocks(fin, blocksize):
+    """ Iterate over the blocks read from fin
+    """
+    while True:
+        block = fin.read(blocksize)
+        if not block:
+            break
+        yield block
+
+def _read_available(fin, blocksize):
+    """ Iterate over the blocks of the bytes arrived at a terminal or a pipe,
+        up to blocksize bytes each
+    """
+    fd = fin.fileno()
+    while True:
+        block = os.read(fd, blocksize)
+        if not block:
+            break
+        yield block
+
+def _skip_bytes(blocks, size):
+    """ Drop the first size bytes of the blocks
+    """
+    try:
+        for block in blocks:
+            if size >= len(block):
+                size -= len(block)
+                continue
+            yield block[size:] if size else block
+            size = 0
+    finally:
+        blocks.close()
+
+def _seek(fobj, offset):
+    """ Move a file opened by filecodec.open_input() forward to the offset
+        in its decompressed data
+    """
+    if isinstance(fobj, BlockLineReader):
+        fobj.blocks = _skip_bytes(fobj.blocks, offset)
+    else:
+        fobj.seek(offset)
+
+def _streaming(fin):
+    """ Whether a file object reads from a terminal or a pipe
+    """
+    try:
+        mode = os.fstat(fin.fileno()).st_mode
+    except (AttributeError, ValueError, OSError, IOError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISCHR(mode) or stat.S_ISSOCK(mode)
+
+def _batches(fin, blocksize):
+    """ Iterate over the lines of a file object or an iterator of lines in
+        batches
+    """
+    if isinstance(fin, BlockLineReader):
+        return _split_blocks(fin.blocks)
+    elif hasattr(fin, 'read'):
+        if _streaming(fin):
+            return _split_blocks(_read_available(fin, blocksize))
+        return _split_blocks(_read_blocks(fin, blocksize))
+    return iter(lambda: list(itertools.islice(fin, BATCHLINES)), [])
+
+def read_batches(fin, blocksize=BATCHSIZE):
+    """ Iterate over the lines of fin in batches, i.e. lists of lines. The
+        lines of a batch are split from a block of about blocksize bytes in
+        one go, instead of being read one by one.
+        fin is a FileInputSet, a file object or an iterator of lines.
+        A terminal or a pipe, e.g. sys.stdin in tail -f FILE | converter.py,
+        is read by the bytes arrived so far instead of waiting for blocksize
+        bytes, so that the lines are given without delay at the cost of
+        smaller batches when the input is slow.
+    """
+    if isinstance(fin, FileInputSet):
+        return fin.iter_batches(blocksize)
+    return _batches(fin, blocksize)
+
 
 class FileInputSet(object):
     """ A file object representing a set of files for reading
+        A source is either a file name, a tuple (file name, start, end)
+        for reading the lines in the byte range [start, end) of a plain file,
+        see split_ranges(), or a LineRange of an indexed file.
+        The first skip lines of the set are skipped, in O(1) for the files
+        with line indexes, see lineindex.py.
+        With track=True, the position of the last line read of a file name
+        source is given by get_position(), or None if the file can not be
+        indexed.
+        The sources failed with IOError are collected in failed.
+        Compressed files are read by their codecs, with gzip files
+        decompressed by gzthreads threads or by pigz, see filecodec.py.
+        iter_batches() keeps the state of the reading, given by get_state(),
+        from which another FileInputSet of the same file names continues
+        with resume=state.
     """
-    def __init__(self, srcs):
+    def __init__(self, srcs, skip=0, track=False, gzthreads=0, pigz=False,
+            resume=None):
         super(FileInputSet, self).__init__()
         self._srcs = srcs
+        self._skip = skip
+        self._track = track
+        self._gzthreads = gzthreads
+        self._pigz = pigz
+        self._resume = resume
+        self._index = 0
+        self._offset = 0
+        self._member = None
+        self._position = None
+        self.failed = set()
         self._current = None
+        self._fobj = None
+        self._closed = False
+
+    def _open(self, src, offset=0):
+        """ Open a source, return (file name, file object or iterator of
+            lines), or (file name, None) if the file is skipped as a whole.
+            A file name source is opened at the offset in its decompressed
+            data.
+        """
+        if isinstance(src, LineRange):
+            src, first, last = src
+            self._fobj = LineIndex.load(src).open_at(first)
+            return src, itertools.islice(self._fobj, last - first)
+        elif isinstance(src, tuple):
+            src, start, end = src
+            self._fobj = open(src)
+            return src, iter_range(self._fobj, start, end)
+        self._position = None
+        self._member = None
+        index = LineIndex.load(src) if self._skip > 0 else None
+        if index is not None:
+            if self._skip >= index.nlines:
+                self._skip -= index.nlines
+                return src, None
+            self._fobj = index.open_at(self._skip)
+            # the offset in the member, see get_state() for the members before
+            self._offset = self._fobj.tell()
+            self._member = (src, index.locate(self._skip)[0])
+            self._skip = 0
+        elif self._track and indexable(src):
+            self._fobj = iter_lines(src)
+            return src, self._tracking(self._fobj)
+        else:
+            self._fobj = open_input(src, self._gzthreads, self._pigz)
+            if offset > 0:
+                _seek(self._fobj, offset)
+        return src, self._fobj
 
     def __iter__(self):
         for src in self._srcs:
+            if self._closed:
+                break
+            cnt = 0
             try:
-                if src.endswith('.gz'):
-                    fin = gzip.open(src)
-                else:
-                    fin = open(src)
-                cnt = 0
+                src, fin = self._open(src)
+                if fin is None:
+                    continue
                 self._current = src
+                fin = iter(fin)
+                while self._skip > 0 and next(fin, None) is not None:
+                    self._skip -= 1
                 for line in fin:
                     yield line
                     cnt += 1
             except IOError as e:
+                self.failed.add(src)
+                logging.warn('%s at %s[%d]' % (e, self.get_current(), cnt))
+            finally:
+                if self._fobj is not None:
+                    self._fobj.close()
+                    self._fobj = None
+
+    def iter_batches(self, blocksize=BATCHSIZE):
+        """ Iterate over the lines in batches, see read_batches()
+        """
+        first, offset = self._resume or (0, 0)
+        for index, src in enumerate(self._srcs):
+            if self._closed:
+                break
+            if index < first:
+                continue
+            self._index = index
+            self._offset = offset if index == first else 0
+            cnt = 0
+            try:
+                src, fin = self._open(src, self._offset)
+                if fin is None:
+                    continue
+                self._current = src
+                for batch in _batches(fin, blocksize):
+                    self._offset += sum(map(len, batch))
+                    if self._skip > 0:
+                        if self._skip >= len(batch):
+                            self._skip -= len(batch)
+                            continue
+                        batch = batch[self._skip:]
+                        self._skip = 0
+                    yield batch
+                    cnt += len(batch)
+            except IOError as e:
+                self.failed.add(src)
                 logging.warn('%s at %s[%d]' % (e, self.get_current(), cnt))
+            finally:
+                if self._fobj is not None:
+                    self._fobj.close()
+                    self._fobj = None
+
+    def close(self):
+        """ Stop the iteration and close the file being read
+        """
+        self._closed = True
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+
+    def _tracking(self, lines):
+        """ Keep the positions of the lines from lineindex.iter_lines()
+        """
+        for member, offset, line in lines:
+            self._position = (member, offset)
+            yield line
+
+    def get_state(self):
+        """ Get the state of iter_batches(), i.e. the index of the source and
+            the offset after the last batch in its decompressed data
+        """
+        if self._member is not None:
+            # the source is seeked into a member by its index, so the sizes
+            # of the members before it are only counted when asked for
+            src, member = self._member
+            self._member = None
+            if member > 0:
+                self._offset += sum(len(data) for _, data in iter_blocks(src, end=member))
+        return self._index, self._offset
+
+    def get_position(self):
+        """ Get the position (member offset, offset in member) of the last
+            line read
+        """
+        return self._position
 
     def get_current(self):
         """ Get current file in the iteration
@@ -0,0 +1,287 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: groupby.py
+Description:
+    Aggregating the items grouped by the values of several fields in one
+    pass, e.g. the number of tweets and the mean of retweets for each pair of
+    (user, lang).
+    An aggregate is given as FUNC or FUNC:FIELD, where FUNC is one of count,
+    sum, min, max, mean, median or pNN for the NN-th percentile, e.g. p90 or
+    p99.9. count without a field counts the items of the group, and with a
+    field the items having the field. The values of the other aggregates are
+    converted to float and missing values are skipped.
+    The state of a group is one flat list of the slots of its aggregates.
+    The percentiles are estimated by the P-square algorithm (Jain and
+    Chlamtac, 1985) with five markers, so that no value is kept.
+    BucketTable counts the items of each token in each bucket, e.g. the day
+    of the item, as a table of an array of counts for each token.
+History:
+    0.1.3 x no add() stub in Aggregate
+    0.1.2 x count:FIELD counts the values without converting them to float
+    0.1.1 + counting the items of the tokens in buckets with BucketTable
+    0.1.0 The first version.
+"""
+__version__ = '0.1.3'
+__author__ = 'SpaceLis'
+
+import re
+import math
+import array
+
+AGGREGATE = re.compile(r'^(?P<func>count|sum|min|max|mean|median|p(?P<pct>\d+(\.\d+)?))'
+        r'(:(?P<field>.+))?$')
+
+
+class Aggregate(object):
+    """ An aggregate of the values of a field, on the slots of a group state
+        from offset. The values are converted to float if numeric.
+        A subclass adds a value to the slots by add(state, val).
+    """
+    size = 1
+    numeric = True
+
+    def __init__(self, spec, field):
+        super(Aggregate, self).__init__()
+        self.spec = spec
+        self.field = field
+        self.offset = 0
+
+    def init(self):
+        """ Return the initial slots
+        """
+        return [None] * self.size
+
+    def result(self, state):
+        """ Return the aggregated value
+        """
+        return state[self.offset]
+
+
+class Count(Aggregate):
+    """ The number of values
+    """
+    numeric = False
+
+    def init(self):
+        return [0]
+
+    def add(self, state, val):
+        state[self.offset] += 1
+
+
+class Sum(Aggregate):
+    """ The sum of values
+    """
+    def init(self):
+        return [0.0]
+
+    def add(self, state, val):
+        state[self.offset] += val
+
+
+class Min(Aggregate):
+    """ The minimum of values
+    """
+    def add(self, state, val):
+        if state[self.offset] is None or val < state[self.offset]:
+            state[self.offset] = val
+
+
+class Max(Aggregate):
+    """ The maximum of values
+    """
+    def add(self, state, val):
+        if state[self.offset] is None or val > state[self.offset]:
+            state[self.offset] = val
+
+
+class Mean(Aggregate):
+    """ The mean of values
+    """
+    size = 2
+
+    def init(self):
+        return [0.0, 0]
+
+    def add(self, state, val):
+        state[self.offset] += val
+        state[self.offset + 1] += 1
+
+    def result(self, state):
+        if state[self.offset + 1] == 0:
+            return None
+        return state[self.offset] / state[self.offset + 1]
+
+
+class Quantile(Aggregate):
+    """ The estimated p-quantile of values by the P-square algorithm
+        The slots are the number of values, the heights of the five markers
+        and their positions.
+    """
+    size = 11
+
+    def __init__(self, spec, field, prob):
+        super(Quantile, self).__init__(spec, field)
+        self.prob = prob
+        # the increments of the desired positions of the markers
+        self.incs = [0.0, prob / 2, prob, (1 + prob) / 2, 1.0]
+
+    def init(self):
+        return [0] + [0.0] * 5 + [1, 2, 3, 4, 5]
+
+    def add(self, state, val):
+        off = self.offset
+        cnt = state[off] + 1
+        state[off] = cnt
+        heights = off + 1
+        positions = off + 6
+        if cnt <= 5:
+            state[heights + cnt - 1] = val
+            if cnt == 5:
+                state[heights:heights + 5] = sorted(state[heights:heights + 5])
+            return
+        # find the cell of val and update the extreme markers
+        if val < state[heights]:
+            state[heights] = val
+            k = 0
+        elif val >= state[heights + 4]:
+            state[heights + 4] = val
+            k = 3
+        else:
+            k = 0
+            while val >= state[heights + k + 1]:
+                k += 1
+        for i in xrange(k + 1, 5):
+            state[positions + i] += 1
+        # adjust the middle markers
+        for i in xrange(1, 4):
+            desired = 1 + (cnt - 1) * self.incs[i]
+            pos = state[positions + i]
+            diff = desired - pos
+            if (diff >= 1 and state[positions + i + 1] - pos > 1) or \
+                    (diff <= -1 and state[positions + i - 1] - pos < -1):
+                d = 1 if diff > 0 else -1
+                q0, q1, q2 = state[heights + i - 1:heights + i + 2]
+                n0, n1, n2 = state[positions + i - 1:positions + i + 2]
+                # the piecewise-parabolic prediction
+                height = q1 + float(d) / (n2 - n0) * ((n1 - n0 + d) * (q2 - q1) / (n2 - n1)
+                        + (n2 - n1 - d) * (q1 - q0) / (n1 - n0))
+                if not q0 < height < q2:
+                    # the linear prediction
+                    height = q1 + d * (state[heights + i + d] - q1) / (state[positions + i + d] - n1)
+                state[heights + i] = height
+                state[positions + i] = n1 + d
+
+    def result(self, state):
+        off = self.offset
+        cnt = state[off]
+        if cnt == 0:
+            return None
+        if cnt <= 5:
+            # the nearest rank
+            values = sorted(state[off + 1:off + 1 + cnt])
+            return values[max(int(math.ceil(self.prob * cnt)) - 1, 0)]
+        return state[off + 3]
+
+
+def parse_aggregate(spec):
+    """ Create the aggregate of a spec, see the description above
+    """
+    m = AGGREGATE.match(spec)
+    if m is None:
+        raise ValueError('Unknown aggregate %s' % (spec,))
+    func, field = m.group('func'), m.group('field')
+    if func == 'count':
+        return Count(spec, field)
+    if field is None:
+        raise ValueError('Aggregate %s needs a field, e.g. %s:FIELD' % (spec, spec))
+    if func == 'median':
+        return Quantile(spec, field, 0.5)
+    if m.group('pct'):
+        prob = float(m.group('pct')) / 100
+        if not 0 < prob < 1:
+            raise ValueError('The percentile of %s should be in (0, 100)' % (spec,))
+        return Quantile(spec, field, prob)
+    return {'sum': Sum, 'min': Min, 'max': Max, 'mean': Mean}[func](spec, field)
+
+
+class GroupBy(object):
+    """ The states of the groups for the aggregates
+        The first slot of a state is the number of items in the group.
+    """
+    def __init__(self, aggregates):
+        super(GroupBy, self).__init__()
+        self.aggregates = aggregates
+        offset = 1
+        init = [0]
+        for agg in aggregates:
+            agg.offset = offset
+            offset += agg.size
+            init.extend(agg.init())
+        self._init = init
+        self.groups = dict()
+
+    def add(self, key, values):
+        """ Add an item of the group key with the values of the aggregates,
+            None for missing values
+        """
+        state = self.groups.get(key)
+        if state is None:
+            state = self.groups[key] = list(self._init)
+        state[0] += 1
+        for agg, val in zip(self.aggregates, values):
+            if val is None:
+                if agg.field is None:
+                    agg.add(state, None)
+                continue
+            agg.add(state, float(val) if agg.numeric else val)
+
+    def results(self, state):
+        """ Return the aggregated values of a group state
+        """
+        return [agg.result(state) for agg in self.aggregates]
+
+    def iteritems(self):
+        """ Iterate over (key, number of items, aggregated values)
+        """
+        for key, state in self.groups.iteritems():
+            yield key, state[0], self.results(state)
+
+
+class BucketTable(object):
+    """ The counts of tokens in buckets
+        The counts of a token are an array indexed by the columns of the
+        buckets in the order of their first occurrences, which is shorter
+        than the number of buckets if the token is not in the later buckets.
+    """
+    def __init__(self):
+        super(BucketTable, self).__init__()
+        self.columns = dict()
+        self.rows = dict()
+
+    def add(self, token, bucket):
+        """ Count an item of the token in the bucket
+        """
+        col = self.columns.get(bucket)
+        if col is None:
+            col = self.columns[bucket] = len(self.columns)
+        row = self.rows.get(token)
+        if row is None:
+            row = self.rows[token] = array.array('l', [0]) * len(self.columns)
+        elif col >= len(row):
+            row.extend([0] * (len(self.columns) - len(row)))
+        row[col] += 1
+
+    def buckets(self):
+        """ Return the buckets in order
+        """
+        return sorted(self.columns)
+
+    def iteritems(self):
+        """ Iterate over (token, total count, [count of each bucket]) with the
+            buckets in order
+        """
+        cols = [self.columns[bucket] for bucket in self.buckets()]
+        for token, row in self.rows.iteritems():
+            nrow = len(row)
+            yield token, sum(row), [row[col] if col < nrow else 0 for col in cols]
@@ -0,0 +1,218 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: gzipreader.py
+Description:
+    Reading the lines of gzip files with the decompression taken out of the
+    thread parsing the lines. The decompressed blocks are either produced by
+    a reader thread and passed through a bounded queue, by several threads
+    each inflating a range of the members of a multi-member gzip file (zlib
+    does not hold the GIL while inflating), or by an external pigz -dc.
+    The members of a gzip file are found by its line index (see
+    lineindex.py) or by the block sizes of BGZF files made by bgzip.
+History:
+    0.1.1 + reading the outputs of decompressing commands
+    0.1.0 The first version.
+"""
+__version__ = '0.1.1'
+__author__ = 'SpaceLis'
+
+import os
+import gzip
+import struct
+import threading
+import subprocess
+import collections
+import Queue
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from distutils.spawn import find_executable
+from lineindex import LineIndex, iter_blocks
+
+BLOCKSIZE = 1 << 20
+QUEUESIZE = 8
+# the compressed size of the ranges of members inflated by one thread
+SEGMENTSIZE = 1 << 20
+
+
+def find_pigz():
+    """ Return the path of pigz, or None if it is not installed
+    """
+    return find_executable('pigz')
+
+def bgzf_members(src):
+    """ Return the offsets of the members of a BGZF file, or None if src is
+        not a BGZF file.
+    """
+    members = list()
+    size = os.path.getsize(src)
+    with open(src, 'rb') as fin:
+        pos = 0
+        while pos < size:
+            fin.seek(pos)
+            header = fin.read(18)
+            # magic, deflate, FEXTRA, XLEN 6, subfield BC of 2 bytes
+            if len(header) < 18 or header[:4] != '\x1f\x8b\x08\x04' \
+                    or header[12:16] != 'BC\x02\x00':
+                return None
+            members.append(pos)
+            pos += struct.unpack('<H', header[16:18])[0] + 1
+    return members
+
+def gzip_members(src):
+    """ Return the known offsets of the members of a gzip file, from its line
+        index or as a BGZF file, or None if they are not known.
+    """
+    index = LineIndex.load(src)
+    if index is not None:
+        members = index.members()
+        if len(members) > 1:
+            return members
+    return bgzf_members(src)
+
+def segments(members, size, segsize=SEGMENTSIZE):
+    """ Group the members into ranges [start, end) of about segsize bytes
+    """
+    ranges = list()
+    start = members[0]
+    for member in members[1:]:
+        if member - start >= segsize:
+            ranges.append((start, member))
+            start = member
+    ranges.append((start, size))
+    return ranges
+
+def _inflate(args):
+    """ Decompress a range of members
+    """
+    src, start, end = args
+    return ''.join(data for _, data in iter_blocks(src, BLOCKSIZE, start, end, True))
+
+
+class BlockLineReader(object):
+    """ Iterate over the lines of decompressed blocks
+        The blocks are given by the generator blocks, which can be consumed
+        directly and is closed by close() for stopping the decompression.
+    """
+    def __init__(self, blocks):
+        super(BlockLineReader, self).__init__()
+        self.blocks = blocks
+
+    def __iter__(self):
+        part = ''
+        for block in self.blocks:
+            cut = block.rfind('\n') + 1
+            if cut == 0:
+                part += block
+                continue
+            if part:
+                start = block.find('\n') + 1
+                yield part + block[:start]
+                block = block[start:]
+                cut -= start
+            for line in StringIO(block[:cut]):
+                yield line
+            part = block[cut:]
+        if part:
+            yield part
+
+    def close(self):
+        """ Stop the decompression
+        """
+        self.blocks.close()
+
+
+def _threaded_blocks(src):
+    """ Yield the blocks of src decompressed by a reader thread
+    """
+    queue = Queue.Queue(QUEUESIZE)
+    stopped = threading.Event()
+
+    def put(item):
+        """ Put an item unless the reading is stopped
+        """
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def reading():
+        try:
+            for _, data in iter_blocks(src, BLOCKSIZE, gzipped=True):
+                if not put(data):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=reading)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            data = queue.get()
+            if data is None:
+                break
+            if isinstance(data, Exception):
+                raise data
+            yield data
+    finally:
+        stopped.set()
+
+def _parallel_blocks(src, members, threads):
+    """ Yield the blocks of src with the ranges of members decompressed by
+        threads in parallel, in the order of the file.
+    """
+    pool = ThreadPool(threads)
+    try:
+        pending = collections.deque()
+        for start, end in segments(members, os.path.getsize(src)):
+            pending.append(pool.apply_async(_inflate, ((src, start, end),)))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def command_blocks(argv, src):
+    """ Yield the blocks of src decompressed by the command argv + [src]
+        writing to its standard output, e.g. pigz -dc.
+    """
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(argv + [src], stdout=subprocess.PIPE,
+                stderr=devnull, bufsize=BLOCKSIZE)
+    try:
+        while True:
+            data = proc.stdout.read(BLOCKSIZE)
+            if not data:
+                break
+            yield data
+        if proc.wait() != 0:
+            raise IOError('%s failed to decompress %s' % (os.path.basename(argv[0]), src))
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+def open_gzip(src, threads=0, pigz=False):
+    """ Open a gzip file for reading its lines
+        With threads=0, it is decompressed while being read, otherwise by a
+        reader thread, or by threads in parallel for the members when the
+        members are known. With pigz=True, it is decompressed by pigz if
+        pigz is installed.
+    """
+    if pigz:
+        path = find_pigz()
+        if path is not None:
+            return BlockLineReader(command_blocks([path, '-dc'], src))
+    if threads <= 0:
+        return gzip.open(src)
+    if threads > 1:
+        members = gzip_members(src)
+        if members is not None:
+            return BlockLineReader(_parallel_blocks(src, members, threads))
+    return BlockLineReader(_threaded_blocks(src))
@@ -4,6 +4,33 @@
 Description:
     A tool for manipulating JSON file
 History:
+    0.4.12 x keeping stdout open after writing the outputs
+    0.4.11 x reading on to the next zone in the same gzip member
+    0.4.10 x refusing --chunk-size below 1 MB
+    0.4.9 x refusing --skip with --jobs and -N instead of scanning all the ranges
+    0.4.8 x cutting the warnings of --jobs where -N stops a serial run
+    0.4.7 x checking conditions in the given order until their REFVAL is converted
+    0.4.6 x decompressing gzip files in the thread parsing the lines by default
+    0.4.5 x removing --lazy, which needed simdjson not available on Python 2
+    0.4.4 x the JSON backend is json unless --json-backend is given
+    0.4.3 x the prefilter is only used with --prefilter
+    0.4.2 + caching the values of the fields and conditions with --cache-dir
+    0.4.1 + writing the fields to Parquet or Arrow IPC files
+    0.4.0 + resumable scans with --checkpoint
+    0.3.9 + reading and writing files compressed by bz2, xz, zstd and lz4
+    0.3.8 + reading lines in batches
+    0.3.7 + decompressing gzip files in threads or by pigz
+    0.3.6 + zone maps for skipping blocks with <=, >= and == conditions
+    0.3.5 + value indexes for == and << conditions
+    0.3.4 + line indexes for seeking, with --build-index and --skip
+    0.3.3 x stopping the reading once --numprint outputs are printed
+    0.3.2 + writing outputs in large blocks, optionally in a thread
+    0.3.1 + lazy decoding of the paths used by fields and conditions
+    0.3.0 + pluggable JSON backends with --json-backend
+    0.2.9 + raw line prefilter for == and << conditions
+    0.2.8 x compiling conditions into one predicate function
+    0.2.7 + parallel scanning of byte ranges of large plain files
+    0.2.6 + parallel scanning of input files with --jobs
     0.2.5 x performance boosting and rearrange console parameters
     0.2.4 + processing CSV format as input
     0.2.3 x fix a bug of outputing jsons, fix a bug of outputing degug info
@@ -13,21 +40,38 @@ History:
     0.1.1 + output whole json objects and '<=' for condition
     0.1.0 The first version.
 """
-__version__ = '0.2.5'
+__version__ = '0.4.12'
 __author__ = 'SpaceLis'
 
 import re
-import json
+import jsonbackend
 import argparse
 import sys
-import gzip
+import errno
 import operator
 import logging
-from fileset import FileInputSet
+import multiprocessing
+import itertools
+import collections
+from fileset import FileInputSet, split_sources, read_batches
+from batchwriter import BatchWriter
+import lineindex
+import valueindex
+import zonemap
+import gzipreader
+import filecodec
+import checkpoint
+import columnar
+import fieldcache
 
 _ARGS = None
 
 NUMBER = re.compile(r'^\d+(\.\d+)?$')
+# Literals which are always encoded as themselves in a JSON string
+SAFELITERAL = re.compile(r'^[\x20-\x7e]*$')
+UNSAFECHARS = re.compile(r'["\\/]')
+INTTOKEN = re.compile(r'\d+')
+STRTOKEN = re.compile(r'"([^"\\]*)"')
 
 class Extractor(object):
     """ Extract an element from an object by a path
@@ -220,11 +264,221 @@ class GotoNextLineException(BaseException):
     def __init__(self):
         super(GotoNextLineException, self).__init__()
 
+
+# The estimated cost of checking a condition by its operator
+_CONDCOST = {'select': 0, '==': 1, '<<': 2, '<=': 3, '>=': 3}
+
+class Prefilter(object):
+    """ A filter on raw lines dropping those cannot match before decoding
+        Only INCLUDE conditions with == or << are used. Once such a condition
+        has converted its REFVAL by the first value seen, a line must contain
+        the JSON literal of REFVAL (for ==), or one of the literals in the set
+        (for <<) to be decoded. For large sets, the integer or string tokens
+        of the line are looked up in the set instead of searching for each
+        literal. Lines
+        passing the filter are still checked by the conditions. REFVAL not
+        always encoded in the same way, e.g. floats with fractions and strings
+        needing escapes, are not used for filtering.
+        Note: the filter assumes the values under a path are of one JSON type,
+        and malformed lines dropped by the filter are not reported, so it is
+        only used with --prefilter.
+    """
+    def __init__(self, conds):
+        super(Prefilter, self).__init__()
+        self.pending = [c for c in conds if c.ispositive and c.mfuncstr in ('==', '<<')]
+        self.literals = list()
+        self.anyliterals = list()
+        self.tokensets = list()
+
+    # The largest set to be searched literal by literal
+    MAXANYLITERALS = 16
+
+    def __len__(self):
+        return len(self.pending) + len(self.literals) + \
+                len(self.anyliterals) + len(self.tokensets)
+
+    @staticmethod
+    def literal(val):
+        """ Return the literal of val in JSON or None if it is not unique
+        """
+        if isinstance(val, bool):
+            return None
+        if isinstance(val, (int, long)):
+            return str(val)
+        if isinstance(val, float):
+            return str(int(val)) if val.is_integer() else None
+        if isinstance(val, basestring):
+            if isinstance(val, unicode):
+                try:
+                    val = val.encode('ascii')
+                except UnicodeError:
+                    return None
+            if SAFELITERAL.match(val) and not UNSAFECHARS.search(val):
+                return val
+        return None
+
+    def refresh(self):
+        """ Take in the conditions which have converted their REFVAL
+        """
+        for cond in [c for c in self.pending if not c.firstmatch]:
+            self.pending.remove(cond)
+            if cond.mfuncstr == '==':
+                lit = Prefilter.literal(cond.refval)
+                if lit is not None:
+                    if isinstance(cond.refval, basestring):
+                        lit = '"' + lit + '"'
+                    self.literals.append(lit)
+                continue
+            lits = set([Prefilter.literal(v) for v in cond.refval])
+            if None in lits or not lits:
+                continue
+            if all(isinstance(v, basestring) for v in cond.refval):
+                if len(lits) <= Prefilter.MAXANYLITERALS:
+                    self.anyliterals.append(['"' + l + '"' for l in lits])
+                else:
+                    self.tokensets.append((STRTOKEN, lits))
+            elif not any(isinstance(v, basestring) for v in cond.refval):
+                if len(lits) <= Prefilter.MAXANYLITERALS:
+                    self.anyliterals.append(list(lits))
+                else:
+                    lits = set([l.lstrip('-') for l in lits])
+                    self.tokensets.append((INTTOKEN, lits))
+
+    def check(self, line):
+        """ Return False if the line can not fulfill the conditions
+        """
+        if self.pending:
+            self.refresh()
+        for lit in self.literals:
+            if lit not in line:
+                return False
+        for lits in self.anyliterals:
+            for lit in lits:
+                if lit in line:
+                    break
+            else:
+                return False
+        for tokenre, lits in self.tokensets:
+            if lits.isdisjoint(tokenre.findall(line)):
+                return False
+        return True
+
+
+def compile_conditions(conds, iscsv=False):
+    """ Compile a list of conditions into one predicate function.
+        The predicate returns True when the object fulfills all the
+        conditions, the same as calling cond.match() on each of them in turn.
+        INCLUDE conditions are still checked before EXCLUDE conditions, but
+        within each group the cheaper ones (fewer path steps, cheaper
+        operators) are checked first. A JSON condition converts its REFVAL
+        by the first value reaching it, so the conditions are checked in the
+        given order by match() until all of them have converted their REFVAL,
+        after which the reordered and inlined checks are used.
+        In debug mode the conditions are simply chained to keep the logging.
+    """
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        def chained(obj):
+            for cond in conds:
+                if not cond.match(obj):
+                    return False
+            return True
+        return chained
+
+    def cost(cond):
+        return (_CONDCOST[cond.mfuncstr], cond.pfunc.ppath.count('['))
+    ordered = sorted([c for c in conds if c.ispositive], key=cost) + \
+            sorted([c for c in conds if not c.ispositive], key=cost)
+
+    env = {'NULLSTR': None}
+    code = ['def predicate(x):']
+
+    def prime(idx, cond, obj):
+        """ Check by match() and inline the check once REFVAL is converted
+        """
+        matched = cond.match(obj)
+        if not cond.firstmatch:
+            env['r%d' % idx] = cond.refval
+            env['t%d' % idx] = type(cond.refval)
+            env['f%d' % idx] = False
+        return matched
+
+    for idx, cond in enumerate(ordered):
+        env['NULLSTR'] = cond.nullstr
+        env['e%d' % idx] = cond.pfunc.parse
+        env['f%d' % idx] = cond.firstmatch
+        env['p%d' % idx] = lambda obj, idx=idx, cond=cond: prime(idx, cond, obj)
+        if cond.pfunc.ppath:
+            access = 'x' + cond.pfunc.ppath
+        else:
+            access = 'e%d(x)' % (idx,)
+        if cond.mfuncstr == '==':
+            test = 'v == r%d'
+        elif cond.mfuncstr == '<=':
+            test = 'v <= r%d'
+        elif cond.mfuncstr == '>=':
+            test = 'v >= r%d'
+        else:
+            test = 'v in r%d'
+        if iscsv and cond.mfuncstr in ('==', '<=', '>='):
+            test = test.replace('v ', 't%d(v) ')
+        test = test.replace('%d', str(idx))
+        if not cond.ispositive and cond.mfuncstr != 'select':
+            test = 'not (' + test + ')'
+
+        if iscsv:
+            code.append('    v = %s' % (access,))
+            if cond.mfuncstr == 'select':
+                code.append('    if v %s NULLSTR: return False' %
+                        ('==' if cond.ispositive else '!=',))
+                continue
+            code.append('    if v == NULLSTR: return False')
+        elif cond.mfuncstr == 'select':
+            code.append('    try: %s' % (access,))
+            if cond.ispositive:
+                code.append('    except KeyError: return False')
+            else:
+                code.append('    except KeyError: pass')
+                code.append('    else: return False')
+            continue
+        else:
+            code.append('    try: v = %s' % (access,))
+            code.append('    except KeyError: return False')
+        code.append('    if f%d:' % (idx,))
+        code.append('        if not p%d(x): return False' % (idx,))
+        code.append('    elif not (%s): return False' % (test,))
+    code.append('    return True')
+    exec '\n'.join(code) in env
+    inlined = env['predicate']
+    pending = [c for c in conds if c.firstmatch and c.mfuncstr != 'select']
+    if iscsv or not pending:
+        return inlined
+
+    def predicate(obj):
+        """ Check in the given order while some REFVAL is not converted
+        """
+        if not pending:
+            return inlined(obj)
+        matched = True
+        for cond in conds:
+            if not cond.match(obj):
+                matched = False
+                break
+        pending[:] = [c for c in pending if c.firstmatch]
+        return matched
+    return predicate
+
+class NumPrintReachedException(BaseException):
+    """ Enough outputs are printed and the reading should stop.
+    """
+    def __init__(self):
+        super(NumPrintReachedException, self).__init__()
+
 class DataPrinter(object):
     """ A printing object
     """
     def __init__(self, fout, extractors, iscsv=False,
-            is_force_in_oneline=False, nullstr='NULL', delimiter='\n', numprint=-1):
+            is_force_in_oneline=False, nullstr='NULL', delimiter='\n', numprint=-1,
+            columns=None):
         super(DataPrinter, self).__init__()
         self.extractors = extractors
         self.iscsv = iscsv
@@ -233,7 +487,10 @@ class DataPrinter(object):
         self.fout = fout
         self.delimiter = delimiter
         self.numprint = numprint
-        if self.iscsv:
+        self.columns = columns
+        if columns is not None:
+            self.prints = self.print_columns
+        elif self.iscsv:
             if len(extractors) > 0:
                 if is_force_in_oneline:
                     self.prints = self.print_csv_oneline
@@ -261,10 +518,10 @@ class DataPrinter(object):
                 output.append((elem.path, unicode(val)))
             except KeyError:
                 output.append((elem.path, unicode(self.nullstr)))
-        print >> self.fout, (json.dumps(dict(output)).encode('utf-8', errors='ignore'))
+        self.fout.write(jsonbackend.dumps(dict(output)).encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
 
     def print_csv(self, obj):
         """ Print obj with respect to extractors
@@ -276,11 +533,11 @@ class DataPrinter(object):
                 output.append(unicode(val))
             except KeyError:
                 output.append(unicode(self.nullstr))
-        print >> self.fout, (self.delimiter.join(output)).\
-            encode('utf-8', errors='ignore')
+        self.fout.write((self.delimiter.join(output)).\
+            encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
 
     def print_csv_oneline(self, obj):
         """ Print obj with respect to extractors and in one line
@@ -292,36 +549,50 @@ class DataPrinter(object):
                 output.append(unicode(val))
             except KeyError:
                 output.append(unicode(self.nullstr))
-        print >> self.fout, (self.delimiter.join(output).replace('\n','')).\
-            encode('utf-8', errors='ignore')
+        self.fout.write((self.delimiter.join(output).replace('\n','')).\
+            encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
+
+    def print_columns(self, obj):
+        """ Write obj with respect to extractors to the columnar writer
+        """
+        output = list()
+        for elem in self.extractors:
+            try:
+                output.append(elem.parse(obj))
+            except KeyError:
+                output.append(None)
+        self.columns.write_row(output)
+        self.numprint -= 1
+        if self.numprint == 0:
+            raise NumPrintReachedException
 
     def printall_json(self, jobj):
         """ Print the entire json
         """
-        print >> self.fout, json.dumps(jobj).encode('utf-8', errors='ignore')
+        self.fout.write(jsonbackend.dumps(jobj).encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
 
     def printall_csv(self, obj):
         """ Print the entire obj
         """
-        print >> self.fout, self.delimiter.join(obj).encode('utf-8', errors='ignore')
+        self.fout.write(self.delimiter.join(obj).encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
 
     def printall_csv_oneline(self, obj):
         """ Print the entire obj in one line
         """
-        print >> self.fout, (self.delimiter.join(obj).replace('\n','')).\
-            encode('utf-8', errors='ignore')
+        self.fout.write((self.delimiter.join(obj).replace('\n','')).\
+            encode('utf-8', errors='ignore') + '\n')
         self.numprint -= 1
         if self.numprint == 0:
-            return
+            raise NumPrintReachedException
 
 def parse_parameter():
     """ Parse the argument
@@ -339,13 +610,28 @@ def parse_parameter():
             help='Only list JSON that doesn\'t has EXCLUDE as a member, or/and '
             'the member {==|>=|<=|<<} a given value. E.g. -x"user.id==123"')
     parser.add_argument('-o', '--output', dest='output', action='store', metavar='FILE',
-            default=None, help='The output file, gzipped if the name ends with .gz')
+            default=None, help='The output file, compressed if the name ends '
+            'with .gz, .bz2, .xz, .zst or .lz4, or in the columnar format '
+            'of --output-format')
+    parser.add_argument('--output-format', dest='outformat', action='store',
+            default=None, choices=['text'] + columnar.FORMATS, help='Write the '
+            'fields as text, or as columns to a Parquet or Arrow IPC file (-o) '
+            'with pyarrow, where missing members are nulls. By default, it is '
+            'found by the extension of the output (.parquet, .arrow, .feather).')
+    parser.add_argument('--row-group-size', dest='rowgroup', action='store',
+            type=int, default=columnar.DEFAULT_ROWGROUP, metavar='NUM',
+            help='Write the columns in row groups (record batches) of NUM rows. '
+            'The types of the columns are inferred from the first row group.')
     parser.add_argument('-j', '--outjson', dest='outjson', action='store_true',
             default=False, help='Output each element in json format.')
     parser.add_argument('-c', '--incsv', dest='incsv', action='store_true', default=False,
             help='Use CSV file as input and output format.')
     parser.add_argument('-n', '--numread', dest='numread', action='store', type=int,
             default=-1, help='Only process NUM JSON objects from input.')
+    parser.add_argument('--skip', dest='skip', action='store', type=int,
+            default=0, metavar='NUM', help='Skip the first NUM lines of the input. '
+            'Files with line indexes are entered directly at the line. It does '
+            'not work with --numprint and --jobs together.')
     parser.add_argument('-N', '--numprint', dest='numprint', action='store', type=int,
             default=-1, help='Only output NUM JSON objects meet the conditions.')
     parser.add_argument('--delimiter', dest='delimiter', action='store',
@@ -358,44 +644,465 @@ def parse_parameter():
     parser.add_argument('--nullstr', dest='nullstr', action='store', default='NULL',
             help='The NULL string used when the member is null '
             'or not found.')
+    parser.add_argument('--jobs', dest='jobs', action='store', type=int,
+            default=1, metavar='N', help='Scan the input files with N worker '
+            'processes and merge their outputs.')
+    parser.add_argument('--ordered', dest='ordered', action='store_true',
+            default=False, help='Keep the outputs of --jobs in the order of '
+            'the input files. Always on when --numread, --numprint or --skip '
+            'is given.')
+    parser.add_argument('--chunk-size', dest='chunksize', action='store', type=int,
+            default=64, metavar='MB', help='With --jobs, plain input files larger '
+            'than MB megabytes are split into ranges scanned by several workers.')
+    parser.add_argument('--prefilter', dest='prefilter', action='store_true',
+            default=False, help='Drop the lines that can not match == or << '
+            'INCLUDE conditions before decoding them. Malformed lines dropped '
+            'this way are not warned about, and the values of a path should be '
+            'of one JSON type, e.g. true does not match 1.')
+    parser.add_argument('--no-prefilter', dest='prefilter', action='store_false',
+            help='Decode every line, the default.')
+    parser.add_argument('--json-backend', dest='json_backend', action='store',
+            default='json', choices=jsonbackend.BACKENDS, help='The JSON library '
+            'used for decoding, the standard library by default. The outputs '
+            'are always encoded by the standard library. See jsonbackend.py.')
+    parser.add_argument('--buffer-size', dest='bufsize', action='store', type=int,
+            default=1024, metavar='KB', help='Write the outputs in blocks of KB '
+            'kilobytes. Outputs to a terminal are not buffered.')
+    parser.add_argument('--write-thread', dest='writethread', action='store_true',
+            default=False, help='Write (and compress) the output blocks in '
+            'a separate thread.')
+    parser.add_argument('--build-index', dest='build_index', action='store_true',
+            default=False, help='Build the line indexes (FILE%s) of the input '
+            'files for seeking lines and splitting gzip files for --jobs.' % (lineindex.INDEXSUFFIX,))
+    parser.add_argument('--index-stride', dest='index_stride', action='store',
+            type=int, default=lineindex.DEFAULT_STRIDE, metavar='NUM',
+            help='Index the position of every NUM-th line.')
+    parser.add_argument('--build-value-index', dest='value_index', action='append',
+            default=list(), metavar='ELEM', help='Build the value indexes (FILE.ELEM%s) '
+            'of the input files for the element, which are used by the INCLUDE '
+            'conditions with == and << on it instead of a full scan.' % (valueindex.INDEXSUFFIX,))
+    parser.add_argument('--build-zonemap', dest='zonemap', action='append',
+            default=list(), metavar='ELEM', help='Build the zone maps '
+            '(FILE.ELEM%s) of the input files for the element while scanning '
+            'them, which are used by the conditions with <=, >= and == on it '
+            'for skipping the blocks of lines that can not match.' % (zonemap.ZONEMAPSUFFIX,))
+    parser.add_argument('--zonemap-block', dest='zonemap_block', action='store',
+            type=int, default=zonemap.DEFAULT_BLOCKLINES, metavar='NUM',
+            help='Keep the minimum and the maximum of every NUM lines in the zone maps.')
+    parser.add_argument('--gzip-threads', dest='gzthreads', action='store',
+            type=int, default=0, metavar='NUM', help='Decompress gzip files in '
+            'a reader thread, or with NUM > 1 in NUM threads for the members of '
+            'gzip files made by bgzip or indexed with --build-index. By default '
+            '(0) they are decompressed in the thread parsing the lines. With a '
+            'reader thread, the lines of a corrupted member read before its '
+            'checksum are output before the error is reported.')
+    parser.add_argument('--pigz', dest='pigz', action='store_true',
+            default=False, help='Decompress gzip files with pigz -dc if it is installed.')
+    parser.add_argument('--checkpoint', dest='checkpoint', action='store',
+            default=None, metavar='FILE', help='Save the progress of the scan '
+            'to FILE regularly and continue from it when FILE exists, e.g. after '
+            'a failure. Only plain and gzip outputs (-o) are truncated to the '
+            'checkpoint, outputs to stdout are not. FILE is removed once the scan '
+            'is finished.')
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval',
+            action='store', type=float, default=checkpoint.DEFAULT_INTERVAL,
+            metavar='SEC', help='Save the checkpoint every SEC seconds.')
+    parser.add_argument('--cache-dir', dest='cachedir', action='store',
+            default=None, metavar='DIR', help='Cache the values of the fields '
+            'and the elements of the conditions for each input file in DIR, '
+            'and use them instead of decoding the lines when all of them are '
+            'cached, e.g. %s.' % (fieldcache.DEFAULT_CACHEDIR,))
+    parser.add_argument('--cache-size', dest='cachesize', action='store',
+            type=int, default=fieldcache.DEFAULT_BUDGET, metavar='MB',
+            help='Remove the least recently used values when the cache is '
+            'larger than MB megabytes.')
     parser.add_argument('--debug', dest='debug', action='store_true', default=False,
             help='Run jrep in debug mode')
     parser.add_argument('sources', metavar='FILE', nargs='*',
-            help='Input files. Those end with .gz will be open as GZIP files.')
+            help='Input files. Those compressed by gzip, bz2, xz, zstd or lz4 '
+            'are found by their extensions or their contents and decompressed.')
     args = parser.parse_args()
+    if args.chunksize < 1:
+        parser.error('--chunk-size should be positive')
+    if args.jobs > 1 and args.skip > 0 and args.numprint >= 0:
+        # the lines of a file range skipped are only known once the ranges
+        # before it are scanned, so the workers could not stop at -N outputs
+        parser.error('--skip and --numprint do not work together with --jobs')
+    args.resume = None
+    if args.checkpoint:
+        if args.jobs > 1 or args.check or args.zonemap or len(args.sources) == 0:
+            parser.error('--checkpoint only works for serial scans of input files '
+                    'without --check or --build-zonemap')
+        if args.output and filecodec.find_codec(args.output, sniff=False) \
+                not in (None, filecodec.CODECS['gzip']):
+            parser.error('--checkpoint only works for plain and gzip outputs')
+        args.checkpoint = checkpoint.Checkpoint(args.checkpoint, args.checkpoint_interval)
+        try:
+            args.resume = args.checkpoint.load()
+        except (IOError, EOFError) as e:
+            parser.error('Failed to load the checkpoint: %s' % (e,))
+        if args.resume is not None and args.resume['sources'] != args.sources:
+            parser.error('The checkpoint is of a scan of other files')
+
     if len(args.sources) > 0:
-        args.fin = FileInputSet(args.sources)
+        if args.resume is not None:
+            args.fin = FileInputSet(args.sources, gzthreads=args.gzthreads,
+                    pigz=args.pigz, resume=args.resume['position'])
+        else:
+            args.fin = FileInputSet(args.sources, args.skip, bool(args.zonemap),
+                    args.gzthreads, args.pigz)
     else:
-        args.fin = sys.stdin
+        args.fin = itertools.islice(sys.stdin, args.skip, None)
 
-    if args.output:
-        if args.output.endswith('.gz'):
-            args.fout = gzip.open(args.output, 'wb')
-        else:
-            args.fout = open(args.output, 'w')
+    args.columns = None
+    if args.outformat is None and args.output:
+        args.outformat = columnar.format_of(args.output)
+    if args.outformat in columnar.FORMATS:
+        if not args.output or not args.fields or args.check:
+            parser.error('--output-format %s needs an output file (-o) and fields (-f)'
+                    % (args.outformat,))
+        if args.jobs > 1 or args.checkpoint:
+            parser.error('--output-format %s does not work with --jobs or --checkpoint'
+                    % (args.outformat,))
+        if args.rowgroup <= 0:
+            parser.error('--row-group-size should be positive')
+        try:
+            args.columns = columnar.ColumnarWriter(args.output, args.fields,
+                    args.outformat, args.rowgroup)
+        except ImportError as e:
+            parser.error('pyarrow is needed for writing %s files: %s' % (args.outformat, e))
+
+    args.rawout = None
+    if args.columns is not None:
+        # nothing is written as text
+        args.fout = sys.stdout
+    elif args.output:
+        try:
+            if args.checkpoint:
+                args.rawout = checkpoint.ResumableOutput(args.output,
+                        args.resume['output'] if args.resume is not None else None)
+                args.fout = args.rawout
+            else:
+                args.fout = filecodec.open_output(args.output)
+        except IOError as e:
+            parser.error(str(e))
     else:
         args.fout = sys.stdout
+    bufsize = 0 if args.fout is sys.stdout and sys.stdout.isatty() else args.bufsize << 10
+    args.fout = BatchWriter(args.fout, bufsize, args.writethread,
+            closing=args.fout is not sys.stdout)
     return args
 
-def json_check(fin, numread):
+def value_index_lookup(srcs, conds):
+    """ Look up the lines to be read in the value indexes for the first
+        INCLUDE condition with == or << whose element is indexed for all the
+        files. Return a list of (file, positions, number of lines) or None.
+    """
+    for cond in conds:
+        if not cond.ispositive or cond.mfuncstr not in ('==', '<<'):
+            continue
+        indexes = [valueindex.ValueIndex.load(src, cond.elem) for src in srcs]
+        if None in indexes:
+            continue
+        if cond.mfuncstr == '==':
+            refvals = [cond.refval]
+        else:
+            with open(cond.refval.name) as fin:
+                refvals = fin.readlines()
+        logging.debug('Using value index for %s' % (cond.str,))
+        return [(index.src, index.lookup(refvals), index.nlines) for index in indexes]
+    return None
+
+def iter_positions(selection, skip=0, numread=-1):
+    """ Iterate over (line number, file, line) for the lines at the positions
+        from value_index_lookup(), with the line numbers counted over all the
+        files as FileInputSet does.
+    """
+    base = 0
+    for src, positions, nlines in selection:
+        reader = lineindex.PositionReader(src)
+        try:
+            for lineno, member, offset in positions:
+                cur_line = base + lineno + 1
+                if cur_line <= skip:
+                    continue
+                if numread >= 0 and cur_line > skip + numread:
+                    return
+                yield cur_line, src, reader.readline_at(member, offset)
+        except IOError as e:
+            logging.warn('%s at %s' % (e, src))
+        finally:
+            reader.close()
+        base += nlines
+
+def zone_map_lookup(srcs, conds):
+    """ Look up the blocks to be read in the zone maps for the conditions
+        with <=, >= or ==. Return a list of (file, blocks or None for reading
+        the whole file, number of lines) or None if no zone map is usable.
+    """
+    conds = [cond for cond in conds if cond.mfuncstr in ('<=', '>=', '==')]
+    if not conds:
+        return None
+    selection = list()
+    used = False
+    for src in srcs:
+        blocks, keeps = None, None
+        for cond in conds:
+            zmap = zonemap.ZoneMap.load(src, cond.elem)
+            if zmap is None:
+                continue
+            # only zone maps with the same blocks can be combined
+            if blocks is not None and [b[0] for b in zmap.blocks] != [b[0] for b in blocks]:
+                continue
+            keep = zmap.keep(cond.mfuncstr, cond.ispositive, cond.refval)
+            if keep is None:
+                continue
+            logging.debug('Using zone map for %s in %s' % (cond.str, src))
+            if blocks is None:
+                blocks, keeps, nlines = zmap.blocks, keep, zmap.nlines
+            else:
+                keeps = [k1 and k2 for k1, k2 in zip(keeps, keep)]
+        if blocks is None:
+            selection.append((src, None, None))
+        else:
+            used = True
+            selection.append((src, [b for b, k in zip(blocks, keeps) if k], nlines))
+    return selection if used else None
+
+def iter_zones(selection, skip=0, numread=-1):
+    """ Iterate over (line number, file, line) for the lines in the blocks
+        from zone_map_lookup(), with the line numbers counted over all the
+        files as FileInputSet does. A file is opened again only for a block
+        in another member or before the position read to.
+    """
+    base = 0
+    for src, blocks, nlines in selection:
+        if blocks is None:
+            cnt = 0
+            for line in FileInputSet([src]):
+                cnt += 1
+                cur_line = base + cnt
+                if cur_line <= skip:
+                    continue
+                if numread >= 0 and cur_line > skip + numread:
+                    return
+                yield cur_line, src, line
+            base += cnt
+            continue
+        fin, nextline, curmember = None, None, None
+        try:
+            for first, member, offset, num, _, _, _ in blocks:
+                if base + first + num <= skip:
+                    continue
+                if numread >= 0 and base + first >= skip + numread:
+                    return
+                if first != nextline:
+                    if fin is not None and member == curmember and offset >= fin.tell():
+                        # read on in the member instead of decompressing it
+                        # from its start again, e.g. a single-member gzip file
+                        fin.seek(offset)
+                    else:
+                        if fin is not None:
+                            fin.close()
+                        fin = lineindex.open_position(src, member, offset)
+                        curmember = member
+                for lineno in xrange(base + first + 1, base + first + num + 1):
+                    line = fin.readline()
+                    if lineno <= skip:
+                        continue
+                    if numread >= 0 and lineno > skip + numread:
+                        return
+                    yield lineno, src, line
+                nextline = first + num
+        except IOError as e:
+            logging.warn('%s at %s' % (e, src))
+        finally:
+            if fin is not None:
+                fin.close()
+        base += nlines
+
+def iter_cached(cache, srcs, paths, skip=0, numread=-1):
+    """ Iterate over (line number, file, object, error) for the lines of
+        the files made from the cached values of the paths, see
+        fieldcache.SparseObjects, with the line numbers counted over all the
+        files as FileInputSet does.
+    """
+    sparse = fieldcache.SparseObjects(paths)
+    cur_line = 0
+    for src in srcs:
+        readers = [cache.open(src, path) for path in paths]
+        try:
+            for obj, error in sparse.iter_objects(readers):
+                cur_line += 1
+                if cur_line <= skip:
+                    continue
+                if numread >= 0 and cur_line > skip + numread:
+                    return
+                yield cur_line, src, obj, error
+        finally:
+            for reader in readers:
+                reader.close()
+
+def save_checkpoint(args, cur_line, dataprinter):
+    """ Save the progress of the serial scan after a batch of lines, with the
+        outputs written and cut
+    """
+    args.fout.flush()
+    output = args.rawout.cut() if args.rawout is not None else None
+    args.checkpoint.save(dict(sources=args.sources, position=args.fin.get_state(),
+        cur_line=cur_line, numprint=dataprinter.numprint, output=output))
+
+def json_check(fin, numread, skip=0):
     """ Check the integrity of the JSONs in the files
     """
+    loads = jsonbackend.loads
+    cur_line = skip
+    for line in fin:
+        cur_line += 1
+        if numread >= 0 and cur_line > skip + numread:
+            break
+        try:
+            obj = loads(line)
+        except ValueError as ve:
+            logging.warn('%s[%d] %s' % (fin.get_current(), cur_line, ve))
+
+class RecordBuffer(object):
+    """ A file-like object collecting what DataPrinter prints for one record
+    """
+    def __init__(self):
+        super(RecordBuffer, self).__init__()
+        self._buf = list()
+
+    def write(self, data):
+        """ Collect the data
+        """
+        self._buf.append(data)
+
+    def pop(self):
+        """ Return the collected data and empty the buffer
+        """
+        data = ''.join(self._buf)
+        self._buf = list()
+        return data
+
+
+_WORKER = None
+
+def _init_worker(settings):
+    """ Build the conditions and the printer once in each worker process
+    """
+    global _WORKER
+    jsonbackend.use(settings['json_backend'])
+    conds = list()
+    for elem in settings['include']:
+        conds.append(MatchCondition(elem, True, settings['nullstr'], settings['incsv']))
+    for elem in settings['exclude']:
+        conds.append(MatchCondition(elem, False, settings['nullstr'], settings['incsv']))
+    match = compile_conditions(conds, settings['incsv'])
+    prefilter = None
+    if settings['prefilter'] and not settings['incsv']:
+        prefilter = Prefilter(conds) or None
+    extractors = [Extractor(elem) for elem in settings['fields']]
+    loads = jsonbackend.loads
+    fout = RecordBuffer()
+    dataprinter = DataPrinter(fout, extractors, not settings['outjson'],
+            settings['oneline'], settings['nullstr'], settings['delimiter'])
+    _WORKER = (settings, loads, match, prefilter, dataprinter, fout)
+
+def _scan_task(task):
+    """ Scan one input file or file range in a worker process.
+        The outputs and the warnings are tagged with the line numbers local
+        to the file, so that the parent can renumber them as in a serial run.
+    """
+    idx, src = task
+    settings, loads, match, prefilter, dataprinter, fout = _WORKER
+    path = src[0] if isinstance(src, tuple) else src
+    numread, numprint = settings['numread'], settings['numprint']
+    records, warnings = list(), list()
+    fin = FileInputSet([src], gzthreads=settings['gzthreads'], pigz=settings['pigz'])
     cur_line = 0
-    if numread >= 0:
-        for line in fin:
-            try:
-                obj = json.loads(line)
-            except ValueError as ve:
-                logging.warn('%s[%d] %s' % (fin.get_current(), cur_line, ve))
-    else:
-        for line in fin:
-            cur_line += 1
-            if cur_line > numread:
+    for line in fin:
+        cur_line += 1
+        if numread >= 0 and cur_line > numread:
+            cur_line -= 1
+            break
+        if prefilter is not None and not prefilter.check(line):
+            continue
+        try:
+            if settings['incsv']:
+                obj = line.strip().split(settings['delimiter'])
+            else:
+                obj = loads(line)
+            if match(obj):
+                dataprinter.prints(obj)
+        except ValueError as ve:
+            warnings.append((cur_line, str(ve)))
+        data = fout.pop()
+        if data:
+            records.append((cur_line, data))
+            if numprint >= 0 and len(records) >= numprint:
                 break
-            try:
-                obj = json.loads(line)
-            except ValueError as ve:
-                logging.warn('%s[%d] %s' % (fin.get_current(), cur_line, ve))
+    fin.close()
+    return idx, path, cur_line, records, warnings
+
+def parallel_scan(args):
+    """ Scan the input files with a pool of worker processes.
+        Each worker scans a whole gzip file or a range of a plain file and
+        the parent merges the outputs into args.fout. Line numbers in the
+        warnings are counted over all the files as in a serial run, so they
+        are only reported once all the ranges before are done. With a window
+        of lines or outputs, the outputs and the warnings of each range are
+        merged by their line numbers and cut where a serial run would stop.
+    """
+    windowed = args.ordered or args.numread >= 0 or args.skip > 0 or args.numprint >= 0
+    lastline = args.skip + args.numread if args.numread >= 0 else -1
+    settings = dict(include=args.include, exclude=args.exclude,
+            nullstr=args.nullstr, incsv=args.incsv, fields=args.fields,
+            outjson=args.outjson, oneline=args.oneline,
+            delimiter=args.delimiter, numread=lastline,
+            numprint=args.numprint,
+            prefilter=args.prefilter,
+            json_backend=args.json_backend,
+            gzthreads=args.gzthreads, pigz=args.pigz)
+    tasks = list(enumerate(split_sources(args.sources, args.chunksize << 20)))
+    pool = multiprocessing.Pool(args.jobs, _init_worker, (settings,))
+    if windowed:
+        results = pool.imap(_scan_task, tasks)
+    else:
+        results = pool.imap_unordered(_scan_task, tasks)
+
+    pending = dict()
+    nextidx, base, printed = 0, 0, 0
+    try:
+        for idx, src, nlines, records, warnings in results:
+            pending[idx] = (src, nlines, records, warnings)
+            if not windowed:
+                for _, data in records:
+                    args.fout.write(data)
+            while nextidx in pending:
+                src, nlines, records, warnings = pending.pop(nextidx)
+                if not windowed:
+                    records = list()
+                # a line gives either an output or a warning
+                events = sorted([(lineno, None, msg) for lineno, msg in warnings]
+                        + [(lineno, data, None) for lineno, data in records])
+                for lineno, data, msg in events:
+                    if base + lineno <= args.skip:
+                        continue
+                    if lastline >= 0 and base + lineno > lastline:
+                        break
+                    if data is None:
+                        logging.warn('%s[%d] %s' % (src, base + lineno, msg))
+                        continue
+                    args.fout.write(data)
+                    printed += 1
+                    if args.numprint >= 0 and printed >= args.numprint:
+                        return
+                base += nlines
+                nextidx += 1
+    finally:
+        pool.terminate()
+        pool.join()
 
 def main():
     """ Main function of this tool which deals with parameter mapping.
@@ -404,6 +1111,30 @@ def main():
     logging.basicConfig(format='%(message)s', level=logging.DEBUG if args.debug else logging.WARNING)
     logging.debug('Version=' + __version__)
     logging.debug(args)
+    try:
+        jsonbackend.use(args.json_backend)
+    except ImportError as e:
+        logging.error('JSON backend %s is not available: %s' % (args.json_backend, e))
+        exit(1)
+    if args.pigz and gzipreader.find_pigz() is None:
+        logging.warn('pigz is not installed, gzip files are decompressed by jrep')
+
+    if args.build_index or args.value_index:
+        for src in args.sources:
+            if not filecodec.indexable(src):
+                logging.warn('No index is built for %s, only plain files and '
+                        'gzip files named .gz can be indexed' % (src,))
+                continue
+            try:
+                if args.build_index:
+                    nlines = lineindex.build_index(src, args.index_stride)
+                    logging.debug('Indexed %d lines of %s' % (nlines, src))
+                for elem in args.value_index:
+                    valueindex.build_value_index(src, elem, Extractor(elem).parse,
+                            jsonbackend.loads)
+            except IOError as e:
+                logging.warn('%s at %s' % (e, src))
+        return
 
     conds = list()
     if args.include:
@@ -412,48 +1143,171 @@ def main():
     if args.exclude:
         for elem in args.exclude:
             conds.append(MatchCondition(elem, False, args.nullstr, args.incsv))
+    match = compile_conditions(conds, args.incsv)
+    prefilter = None
+    if args.prefilter and not args.incsv:
+        prefilter = Prefilter(conds) or None
 
     extractors = list()
     for elem in args.fields:
         extractors.append(Extractor(elem))
 
+    numprint = args.numprint if args.resume is None else args.resume['numprint']
     dataprinter = DataPrinter(args.fout, extractors, not args.outjson,
-                            args.oneline, args.nullstr, args.delimiter, args.numprint)
+                            args.oneline, args.nullstr, args.delimiter, numprint,
+                            args.columns)
 
-    if not args.check:
-        cur_line = 0
-        if not args.incsv:
-            for line in args.fin:
-                cur_line += 1
-                if args.numread >= 0 and cur_line > args.numread:
-                    break
+    builder = None
+    if args.zonemap:
+        if args.jobs > 1 or args.check or args.incsv or len(args.sources) == 0:
+            logging.warn('Zone maps are only built by scanning JSON files without --jobs')
+        else:
+            builder = zonemap.ZoneMapBuilder(args.zonemap,
+                    [Extractor(elem).parse for elem in args.zonemap], args.zonemap_block)
+            # every line has to be decoded for the zone maps
+            prefilter = None
+
+    selected = None
+    if args.jobs <= 1 and len(args.sources) > 0 and not args.check \
+            and not args.incsv and builder is None and not args.checkpoint:
+        selection = value_index_lookup(args.sources, conds)
+        if selection is not None:
+            selected = iter_positions(selection, args.skip, args.numread)
+        else:
+            selection = zone_map_lookup(args.sources, conds)
+            if selection is not None:
+                selected = iter_zones(selection, args.skip, args.numread)
+
+    cache, cached, cachebuilder = None, None, None
+    if args.cachedir and selected is None:
+        paths = list(collections.OrderedDict.fromkeys(
+            list(args.fields) + [cond.elem for cond in conds]))
+        if args.jobs > 1 or args.check or args.incsv or len(args.sources) == 0 \
+                or builder is not None or args.checkpoint or not args.fields:
+            logging.warn('The field cache is only used for scanning JSON files '
+                    'for fields without --jobs, --build-zonemap or --checkpoint')
+        elif not all(fieldcache.cacheable(path) for path in paths):
+            logging.warn('The field cache can not be used with the paths given')
+        else:
+            cache = fieldcache.FieldCache(args.cachedir, args.cachesize << 20)
+            missing = cache.find(args.sources, paths)
+            if not missing:
+                cached = iter_cached(cache, args.sources, paths, args.skip, args.numread)
+            elif args.skip == 0:
+                cachebuilder = fieldcache.FieldCacheBuilder(cache, missing,
+                        dict((path, Extractor(path).parse) for path in paths))
+                # every line has to be decoded for the cache
+                prefilter = None
+    complete = False
+
+    try:
+        if args.numprint == 0 and not args.check:
+            pass
+        elif args.jobs > 1 and len(args.sources) > 0 and not args.check:
+            parallel_scan(args)
+        elif selected is not None:
+            loads = jsonbackend.loads
+            for cur_line, src, line in selected:
+                if prefilter is not None and not prefilter.check(line):
+                    continue
                 try:
-                    obj = json.loads(line)
-                    for cond in conds:
-                        if not cond.match(obj):
-                            raise GotoNextLineException
-                    dataprinter.prints(obj)
-                except GotoNextLineException:
-                    pass
+                    obj = loads(line)
+                    if match(obj):
+                        dataprinter.prints(obj)
                 except ValueError as ve:
-                    logging.warn('%s[%d] %s' % (args.fin.get_current(), cur_line, ve))
-        else:
-            for line in args.fin:
-                cur_line += 1
-                if args.numread >= 0 and cur_line > args.numread:
-                    break
+                    logging.warn('%s[%d] %s' % (src, cur_line, ve))
+        elif cached is not None:
+            for cur_line, src, obj, error in cached:
+                if error is not None:
+                    logging.warn('%s[%d] %s' % (src, cur_line, error))
+                    continue
                 try:
-                    obj = line.strip().split(args.delimiter)
-                    for cond in conds:
-                        if not cond.match(obj):
-                            raise GotoNextLineException
-                    dataprinter.prints(obj)
-                except GotoNextLineException:
-                    pass
+                    if match(obj):
+                        dataprinter.prints(obj)
                 except ValueError as ve:
-                    logging.warn('%s[%d] %s' % (args.fin.get_current(), cur_line, ve))
-    else:
-        json_check(args.fin, args.numread)
+                    logging.warn('%s[%d] %s' % (src, cur_line, ve))
+        elif not args.check:
+            cur_line = args.skip if args.resume is None else args.resume['cur_line']
+            lastline = args.skip + args.numread if args.numread >= 0 else -1
+            if builder is None:
+                batches = read_batches(args.fin)
+            else:
+                # the zone maps need the position of every line
+                batches = ([line] for line in args.fin)
+            if not args.incsv:
+                loads = jsonbackend.loads
+                for batch in batches:
+                    if lastline >= 0 and cur_line + len(batch) > lastline:
+                        batch = batch[:lastline - cur_line]
+                        if not batch:
+                            break
+                    for line in batch:
+                        cur_line += 1
+                        if prefilter is not None and not prefilter.check(line):
+                            continue
+                        obj = None
+                        try:
+                            obj = loads(line)
+                            if builder is not None:
+                                builder.add(args.fin, obj)
+                            if cachebuilder is not None:
+                                cachebuilder.add(args.fin, obj)
+                            if match(obj):
+                                dataprinter.prints(obj)
+                        except ValueError as ve:
+                            logging.warn('%s[%d] %s' % (args.fin.get_current(), cur_line, ve))
+                            if builder is not None and obj is None:
+                                builder.add(args.fin, None)
+                            if cachebuilder is not None and obj is None:
+                                cachebuilder.add(args.fin, None, '%s' % (ve,))
+                    if args.checkpoint and args.checkpoint.due():
+                        save_checkpoint(args, cur_line, dataprinter)
+                else:
+                    complete = True
+                    if builder is not None:
+                        # zone maps of files partly read are not written
+                        builder.close(args.skip == 0)
+            else:
+                for batch in batches:
+                    if lastline >= 0 and cur_line + len(batch) > lastline:
+                        batch = batch[:lastline - cur_line]
+                        if not batch:
+                            break
+                    for line in batch:
+                        cur_line += 1
+                        try:
+                            obj = line.strip().split(args.delimiter)
+                            if match(obj):
+                                dataprinter.prints(obj)
+                        except ValueError as ve:
+                            logging.warn('%s[%d] %s' % (args.fin.get_current(), cur_line, ve))
+                    if args.checkpoint and args.checkpoint.due():
+                        save_checkpoint(args, cur_line, dataprinter)
+        else:
+            json_check(args.fin, args.numread, args.skip)
+    except NumPrintReachedException:
+        pass
+    except IOError as e:
+        # the reading end of the pipe is closed, e.g. by head
+        if e.errno != errno.EPIPE:
+            raise
+    try:
+        if isinstance(args.fin, FileInputSet):
+            args.fin.close()
+        if args.columns is not None:
+            args.columns.close()
+        args.fout.close()
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+    if cachebuilder is not None:
+        # the values of files partly read are not cached
+        cachebuilder.close(complete)
+    if cache is not None:
+        cache.evict()
+        cache.report()
+    if args.checkpoint:
+        args.checkpoint.remove()
 
 
 if __name__ == '__main__':
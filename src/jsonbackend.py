@@ -0,0 +1,60 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: jsonbackend.py
+Description:
+    Pluggable JSON decoder and encoder for the tools, using the faster JSON
+    libraries when they are asked for.
+    The backend is chosen by use() and the tools call loads() and dumps()
+    of this module afterwards.
+    Backends:
+        json        decoder and encoder in the standard library, the default.
+        ujson       decoder of ujson with precise floats. Lines it fails on,
+                    e.g. integers too big for it, are decoded again by json,
+                    so the objects and the error messages are those of json.
+                    The encoder is the one in the standard library.
+    The outputs are encoded by the standard library with every backend, so
+    they are the bytes of the previous versions of the tools.
+    All the decoders raise ValueError on malformed JSON.
+    orjson and pysimdjson only support Python 3 and are not used.
+History:
+    0.1.3 x removing partial_loads(), which needed simdjson
+    0.1.2 x json is the default backend, ujson retries its failures with json
+    0.1.1 + partial decoding of requested paths with simdjson
+    0.1.0 The first version.
+"""
+__version__ = '0.1.3'
+__author__ = 'SpaceLis'
+
+import json
+import logging
+
+BACKENDS = ['json', 'ujson']
+
+loads = json.loads
+dumps = json.dumps
+current = 'json'
+
+def _load_backend(name):
+    """ Return the (loads, dumps) of a backend or raise ImportError
+    """
+    if name == 'ujson':
+        import ujson
+        def ujson_loads(line, fastloads=ujson.loads, slowloads=json.loads):
+            try:
+                return fastloads(line, precise_float=True)
+            except (ValueError, OverflowError):
+                return slowloads(line)
+        return ujson_loads, json.dumps
+    elif name == 'json':
+        return json.loads, json.dumps
+    raise ValueError('Unknown JSON backend: %s' % (name,))
+
+def use(name='json'):
+    """ Use the backend of the name for loads() and dumps()
+        ImportError is raised if the backend is not installed.
+    """
+    global loads, dumps, current
+    loads, dumps = _load_backend(name)
+    current = name
+    logging.debug('JSON Backend: %s' % (current,))
+    return current
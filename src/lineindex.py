@@ -0,0 +1,291 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: lineindex.py
+Description:
+    Sidecar index of line positions for line-JSON files, plain or gzipped.
+    The index of FILE is stored in FILE.jidx and holds the position of every
+    STRIDE-th line, so that reading from any line only takes a seek and
+    skipping less than STRIDE lines.
+    A position is a pair of the offset of the gzip member (0 for plain files)
+    and the offset in the decompressed data of the member. Gzip files made
+    of many members, e.g. by pigz, bgzip or by concatenating gzip files, can
+    be entered at each member. A single-member gzip file has to be
+    decompressed from its beginning up to the position.
+    An index is ignored with a warning when the size or the modification
+    time of the file has changed since the index was built.
+History:
+    0.1.4 + reading blocks of gzip files not named .gz
+    0.1.3 + reading blocks of a range of members
+    0.1.2 + opening files at positions
+    0.1.1 + iterating lines with positions and reading lines at positions
+    0.1.0 The first version.
+"""
+__version__ = '0.1.4'
+__author__ = 'SpaceLis'
+
+import os
+import mmap
+import zlib
+import gzip
+import struct
+import logging
+import collections
+
+INDEXSUFFIX = '.jidx'
+DEFAULT_STRIDE = 256
+
+# magic, version, stride, file size, file mtime, number of lines
+_HEADER = struct.Struct('<4sIQQdQ')
+# member offset, offset in the member
+_ENTRY = struct.Struct('<QQ')
+_MAGIC = 'JIDX'
+_VERSION = 1
+
+# A source for FileInputSet reading the lines [first, last) of an indexed file
+LineRange = collections.namedtuple('LineRange', 'src first last')
+
+
+def index_path(src):
+    """ Return the path of the index of src
+    """
+    return src + INDEXSUFFIX
+
+def iter_blocks(src, bufsize=1 << 20, start=0, end=None, gzipped=None):
+    """ Iterate over (member offset, data) for the decompressed blocks of a
+        gzip file or the blocks of a plain file (always at member offset 0).
+        Only the bytes [start, end) of the file are read, where start and
+        end (the end of the file if None) have to be member boundaries.
+        A file is taken as gzipped by its extension .gz if gzipped is None.
+        Raise IOError on corrupted or truncated gzip files.
+    """
+    with open(src, 'rb') as raw:
+        raw.seek(start)
+        pos = start
+        if gzipped is None:
+            gzipped = src.endswith('.gz')
+        if not gzipped:
+            while end is None or pos < end:
+                data = raw.read(bufsize if end is None else min(bufsize, end - pos))
+                if not data:
+                    return
+                pos += len(data)
+                yield 0, data
+            return
+        member = start
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        started = False
+        while end is None or pos < end:
+            buf = raw.read(bufsize if end is None else min(bufsize, end - pos))
+            if not buf:
+                break
+            pos += len(buf)
+            while buf:
+                try:
+                    data = decomp.decompress(buf)
+                except zlib.error as e:
+                    raise IOError('%s at member %d' % (e, member))
+                started = True
+                if data:
+                    yield member, data
+                buf = decomp.unused_data
+                if buf:
+                    member = pos - len(buf)
+                    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    started = False
+        if started and _unfinished(decomp):
+            raise IOError('Truncated gzip member at %d' % (member,))
+
+def _unfinished(decomp):
+    """ Whether the decompressor has not reached the end of its stream
+    """
+    try:
+        decomp.decompress('\0')
+    except zlib.error:
+        return True
+    return not decomp.unused_data
+
+def open_position(src, member, offset):
+    """ Open a plain or gzip file at the position (member offset, offset in
+        member). Reading continues into the following members.
+    """
+    if src.endswith('.gz'):
+        raw = open(src, 'rb')
+        raw.seek(member)
+        fin = gzip.GzipFile(fileobj=raw)
+        # let the GzipFile close the raw file
+        fin.myfileobj = raw
+    else:
+        fin = open(src, 'rb')
+    fin.seek(offset)
+    return fin
+
+def iter_lines(src):
+    """ Iterate over (member offset, offset in member, line) for the lines
+        of a plain or gzip file. A line may continue into the next member.
+    """
+    curmember, moffset = None, 0
+    part, partpos = '', None
+    for member, data in iter_blocks(src):
+        if member != curmember:
+            curmember, moffset = member, 0
+        pos, size = 0, len(data)
+        while pos < size:
+            end = data.find('\n', pos)
+            if end < 0:
+                if partpos is None:
+                    partpos = (member, moffset + pos)
+                part += data[pos:]
+                break
+            if partpos is not None:
+                yield partpos + (part + data[pos:end + 1],)
+                part, partpos = '', None
+            else:
+                yield member, moffset + pos, data[pos:end + 1]
+            pos = end + 1
+        moffset += size
+    if partpos is not None:
+        yield partpos + (part,)
+
+def build_index(src, stride=DEFAULT_STRIDE):
+    """ Build the index of src and write it to the sidecar file
+        Return the number of lines in src.
+    """
+    stat = os.stat(src)
+    entries = list()
+    nlines = 0
+    linestart = True
+    curmember, moffset = None, 0
+    for member, data in iter_blocks(src):
+        if member != curmember:
+            curmember, moffset = member, 0
+        pos, size = 0, len(data)
+        while pos < size:
+            if linestart:
+                if nlines % stride == 0:
+                    entries.append((member, moffset + pos))
+                linestart = False
+            end = data.find('\n', pos)
+            if end < 0:
+                break
+            nlines += 1
+            pos = end + 1
+            linestart = True
+        moffset += size
+    if not linestart:
+        nlines += 1
+    tmppath = index_path(src) + '.tmp'
+    with open(tmppath, 'wb') as fout:
+        fout.write(_HEADER.pack(_MAGIC, _VERSION, stride, stat.st_size,
+            stat.st_mtime, nlines))
+        for entry in entries:
+            fout.write(_ENTRY.pack(*entry))
+    os.rename(tmppath, index_path(src))
+    return nlines
+
+
+class LineIndex(object):
+    """ The index of line positions of a file, see build_index()
+        The entries are read from the memory-mapped index file on demand.
+    """
+    def __init__(self, src, stride, nlines, mm):
+        super(LineIndex, self).__init__()
+        self.src = src
+        self.stride = stride
+        self.nlines = nlines
+        self._mm = mm
+
+    @classmethod
+    def load(cls, src):
+        """ Load the index of src, or return None if there is no index or
+            the index is out of date.
+        """
+        path = index_path(src)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fin:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, stride, size, mtime, nlines = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            logging.warn('Unknown index format of %s' % (src,))
+            return None
+        stat = os.stat(src)
+        if stat.st_size != size or stat.st_mtime != mtime:
+            logging.warn('Index of %s is out of date, rebuild it with --build-index' % (src,))
+            return None
+        return cls(src, stride, nlines, mm)
+
+    def members(self):
+        """ Return the sorted offsets of the gzip members where the indexed
+            lines start
+        """
+        nentries = (self.nlines + self.stride - 1) // self.stride
+        return sorted(set(_ENTRY.unpack_from(self._mm, _HEADER.size + k * _ENTRY.size)[0]
+            for k in xrange(nentries)))
+
+    def locate(self, lineno):
+        """ Return (member offset, offset in member, lines to skip) for
+            reaching the line lineno (counted from 0)
+        """
+        k = lineno // self.stride
+        member, offset = _ENTRY.unpack_from(self._mm, _HEADER.size + k * _ENTRY.size)
+        return member, offset, lineno - k * self.stride
+
+    def open_at(self, lineno):
+        """ Open the file positioned at the line lineno (counted from 0)
+        """
+        if lineno >= self.nlines:
+            fin = open(self.src, 'rb')
+            fin.seek(0, 2)
+            return fin
+        member, offset, skip = self.locate(lineno)
+        fin = open_position(self.src, member, offset)
+        for _ in xrange(skip):
+            fin.readline()
+        return fin
+
+    def split(self, nchunks):
+        """ Split the lines into about nchunks LineRanges at indexed lines
+        """
+        nentries = (self.nlines + self.stride - 1) // self.stride
+        nchunks = max(1, min(nchunks, nentries))
+        ranges = list()
+        for i in xrange(nchunks):
+            first = nentries * i // nchunks * self.stride
+            last = min(nentries * (i + 1) // nchunks * self.stride, self.nlines)
+            if first < last:
+                ranges.append(LineRange(self.src, first, last))
+        return ranges
+
+
+class PositionReader(object):
+    """ Read lines at positions given in the order in the file, reusing the
+        opened member of gzip files when reading forward in it.
+    """
+    def __init__(self, src):
+        super(PositionReader, self).__init__()
+        self.src = src
+        self._fin = None
+        self._member = None
+        self._isgzip = src.endswith('.gz')
+
+    def readline_at(self, member, offset):
+        """ Read the line at the position
+        """
+        if not self._isgzip:
+            if self._fin is None:
+                self._fin = open(self.src, 'rb')
+            self._fin.seek(offset)
+            return self._fin.readline()
+        if self._fin is None or member != self._member or offset < self._fin.tell():
+            self.close()
+            self._fin = open_position(self.src, member, 0)
+            self._member = member
+        self._fin.seek(offset)
+        return self._fin.readline()
+
+    def close(self):
+        """ Close the file being read
+        """
+        if self._fin is not None:
+            self._fin.close()
+            self._fin = None
@@ -0,0 +1,254 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: sketches.py
+Description:
+    Approximate statistics of tokens in fixed memory, for fields with too
+    many distinct values to be counted exactly.
+    SpaceSaving(counters) keeps the counts of at most counters tokens. Every
+    token occurring more than N / counters times of N tokens is kept, and the
+    count of a token is over-estimated by at most N / counters.
+    CountMinSketch(width, depth, topk) keeps depth rows of width counters and
+    the topk tokens of the largest estimates. The estimate of a token is
+    over-estimated by at most e * N / width with a probability of
+    1 - exp(-depth).
+    HyperLogLog(precision) estimates the number of distinct tokens with
+    2 ** precision registers of one byte, with a standard error of
+    1.04 / sqrt(2 ** precision), e.g. 0.8% with precision 14 (16KB).
+    The sketches of the same kind and sizes are merged by merge(), e.g. those
+    of different files, and saved and loaded by save() and load().
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import os
+import math
+import array
+import heapq
+import struct
+import marshal
+import hashlib
+import cPickle as pickle
+
+_VERSION = 1
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(token):
+    """ Return a 64-bit hash of a token which is the same in every process
+    """
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(marshal.dumps(token)).digest()[:8])[0]
+
+
+class SpaceSaving(object):
+    """ The Space-Saving summary of the most frequent tokens
+    """
+    def __init__(self, counters=10000):
+        super(SpaceSaving, self).__init__()
+        self.counters = counters
+        self.total = 0
+        self.counts = dict()
+        # (count, token) with outdated entries, see _pop_min()
+        self._heap = list()
+
+    def _push(self, token, count):
+        """ Set the count of a token
+        """
+        self.counts[token] = count
+        heapq.heappush(self._heap, (count, token))
+        if len(self._heap) > 2 * self.counters + 16:
+            self._heap = [(c, t) for t, c in self.counts.iteritems()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        """ Remove the token of the smallest count and return the count
+        """
+        while True:
+            count, token = heapq.heappop(self._heap)
+            if self.counts.get(token) == count:
+                del self.counts[token]
+                return count
+
+    def add(self, token, count=1):
+        """ Count a token
+        """
+        self.total += count
+        if token in self.counts:
+            self._push(token, self.counts[token] + count)
+        elif len(self.counts) < self.counters:
+            self._push(token, count)
+        else:
+            self._push(token, self._pop_min() + count)
+
+    def _min_count(self):
+        """ The upper bound of the counts of the tokens not kept
+        """
+        if len(self.counts) < self.counters:
+            return 0
+        return min(self.counts.itervalues())
+
+    def merge(self, other):
+        """ Add the counts of another SpaceSaving with the same number of
+            counters
+        """
+        if self.counters != other.counters:
+            raise ValueError('Space-Saving summaries of different sizes can not be merged')
+        floor, otherfloor = self._min_count(), other._min_count()
+        counts = dict()
+        for token in set(self.counts) | set(other.counts):
+            counts[token] = self.counts.get(token, floor) + other.counts.get(token, otherfloor)
+        counts = heapq.nlargest(self.counters, counts.iteritems(), key=lambda x: x[1])
+        self.total += other.total
+        self.counts = dict(counts)
+        self._heap = [(c, t) for t, c in self.counts.iteritems()]
+        heapq.heapify(self._heap)
+
+    def top(self, k=None):
+        """ Return the k tokens of the largest counts as [(token, count)]
+        """
+        return heapq.nlargest(k or len(self.counts), self.counts.iteritems(),
+                key=lambda x: x[1])
+
+
+class CountMinSketch(object):
+    """ The Count-Min sketch of the counts of tokens with the topk tokens of
+        the largest estimates
+    """
+    def __init__(self, width=1 << 16, depth=4, topk=100):
+        super(CountMinSketch, self).__init__()
+        self.width = width
+        self.depth = depth
+        self.topk = topk
+        self.total = 0
+        self.rows = [array.array('l', [0]) * width for _ in xrange(depth)]
+        self.candidates = dict()
+        self._threshold = 0
+
+    def _cells(self, token):
+        """ Return the cell of the token in each row
+        """
+        hval = hash64(token)
+        h1, h2 = hval & 0xffffffff, hval >> 32
+        return [(h1 + i * h2) % self.width for i in xrange(self.depth)]
+
+    def estimate(self, token):
+        """ Return the estimated count of a token
+        """
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(token)))
+
+    def _candidate(self, token, estimate):
+        """ Keep the token if its estimate is among the topk
+        """
+        if token in self.candidates or len(self.candidates) < self.topk:
+            self.candidates[token] = estimate
+        elif estimate > self._threshold:
+            mintoken = min(self.candidates, key=self.candidates.get)
+            if estimate > self.candidates[mintoken]:
+                del self.candidates[mintoken]
+                self.candidates[token] = estimate
+            self._threshold = min(self.candidates.itervalues())
+
+    def add(self, token, count=1):
+        """ Count a token
+        """
+        self.total += count
+        estimate = None
+        for row, cell in zip(self.rows, self._cells(token)):
+            row[cell] += count
+            if estimate is None or row[cell] < estimate:
+                estimate = row[cell]
+        self._candidate(token, estimate)
+
+    def merge(self, other):
+        """ Add the counts of another CountMinSketch of the same sizes
+        """
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError('Count-Min sketches of different sizes can not be merged')
+        for row, otherrow in zip(self.rows, other.rows):
+            for i, val in enumerate(otherrow):
+                if val:
+                    row[i] += val
+        self.total += other.total
+        tokens = set(self.candidates) | set(other.candidates)
+        self.candidates = dict()
+        self._threshold = 0
+        for token in tokens:
+            self._candidate(token, self.estimate(token))
+
+    def top(self, k=None):
+        """ Return the k tokens of the largest estimates as [(token, count)]
+        """
+        return heapq.nlargest(k or len(self.candidates), self.candidates.iteritems(),
+                key=lambda x: x[1])
+
+
+class HyperLogLog(object):
+    """ The HyperLogLog sketch of the number of distinct tokens
+    """
+    def __init__(self, precision=14):
+        super(HyperLogLog, self).__init__()
+        if not 4 <= precision <= 16:
+            raise ValueError('The precision of HyperLogLog should be in [4, 16]')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, token, count=1):
+        """ Count a token
+        """
+        hval = hash64(token)
+        idx = hval >> (64 - self.precision)
+        rest = (hval << self.precision) & _MASK64
+        # the position of the first 1 bit in the rest
+        rank = 64 - self.precision + 1 if rest == 0 else 64 - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        """ Add the tokens of another HyperLogLog of the same precision
+        """
+        if self.precision != other.precision:
+            raise ValueError('HyperLogLogs of different precisions can not be merged')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        """ Return the estimated number of distinct tokens
+        """
+        m = len(self.registers)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * m and zeros > 0:
+            # linear counting for small numbers
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+SKETCHES = {'spacesaving': SpaceSaving, 'countmin': CountMinSketch, 'hll': HyperLogLog}
+
+
+def save(sketch, path):
+    """ Save a sketch to a file
+    """
+    tmppath = path + '.tmp'
+    with open(tmppath, 'wb') as fout:
+        pickle.dump(dict(version=_VERSION, sketch=sketch), fout, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmppath, path)
+
+def load(path):
+    """ Load a sketch saved by save()
+    """
+    with open(path, 'rb') as fin:
+        state = pickle.load(fin)
+    if not isinstance(state, dict) or state.get('version') != _VERSION:
+        raise IOError('Unknown sketch format of %s' % (path,))
+    return state['sketch']
@@ -4,74 +4,401 @@
 Description:
     Get statistics of tokens from input, i.e. the number of occurrences.
 History:
+    0.3.3 x refusing the fields of -t csv which are not column indices
+    0.3.2 x refusing --chunk-size below 1 MB
+    0.3.1 x reporting checkpoint files failed to load
+    0.3.0 + converting the fields with --convert, counting in time buckets
+            with --bucket-by
+    0.2.9 + aggregating groups of items with --group-by and --aggregate
+    0.2.8 + spilling the counts to disk with --memory
+    0.2.7 + approximate statistics in fixed memory with --approx
+    0.2.6 + counting the files or their ranges in parallel with --jobs, --top
+    0.2.5 + caching the values of the fields with --cache-dir
+    0.2.4 + resumable statistics with --checkpoint
+    0.2.3 + reading lines in batches
+    0.2.2 + pluggable JSON backends with --json-backend
     0.2.1 x move converters out and introducing fields combination
     0.2.0 + Ability of converting a field of an item before statistics
     0.1.1 + Sorting option for outputs.
     0.1.0 The first version.
 """
-__version__ = '0.1.1'
+__version__ = '0.3.3'
 __author__ = 'SpaceLis'
 
 import argparse
 import sys
+import heapq
 import logging
-import json
-from fileset import FileInputSet
+import itertools
+import collections
+import multiprocessing
+import jsonbackend
+import checkpoint
+import fieldcache
+import sketches
+import extcounter
+import groupby
+import converter
+from fileset import FileInputSet, read_batches, split_sources
 
-def discrete_statistics(instream, args):
+_SETTINGS = None
+# the errors of reading a field of an item, by input types
+_INDEXERRORS = {'json': KeyError, 'csv': IndexError}
+# the other errors of counting a line
+_LINEERRORS = {'json': ValueError, 'csv': Exception, None: Exception}
+# the number of tokens kept by Count-Min sketches without --top
+DEFAULT_TOPK = 100
+# the converters of the buckets of --bucket-by
+BUCKETS = collections.OrderedDict([('day', 'TT2DayConverter'),
+    ('week', 'TT2WeekConverter'), ('month', 'TT2MonthConverter')])
+
+def cacheable_field(field):
+    """ Whether the values of a field of JSON objects can be cached, i.e.
+        it is also an element path for the cache
+    """
+    return '.' not in field and not field.startswith(('@', ':'))
+
+def field_converters(fields, specs):
+    """ Return [(field, pipeline)] of the fields, where pipeline is the
+        converter.Pipeline of the field in the --convert specs, or None
+    """
+    pipelines = dict()
+    for spec in specs:
+        name, cvnames = spec.split(':', 1)
+        pipelines[name] = converter.Pipeline(cvnames.split(':'))
+    return [(field, pipelines.get(str(field))) for field in fields]
+
+def new_sketch(settings):
+    """ Create an empty sketch from (name, parameters), see sketch_settings()
+    """
+    name, params = settings
+    return sketches.SKETCHES[name](**params)
+
+def sketch_settings(args):
+    """ Return (name, parameters) of the sketch of --approx
+    """
+    if args.approx == 'spacesaving':
+        return args.approx, dict(counters=args.counters)
+    elif args.approx == 'countmin':
+        return args.approx, dict(width=args.cms_width, depth=args.cms_depth,
+                topk=args.top or DEFAULT_TOPK)
+    return args.approx, dict(precision=args.hll_precision)
+
+def discrete_statistics(instream, args, ckpt=None, resume=None, cached=None,
+        builder=None, counter=None):
     """ Do statistics on a searious dicrete tokens
+        The progress is saved to the checkpoint ckpt after batches of lines
+        and continued from the state resume.
+        The values of the fields of JSON inputs are read from the field cache
+        cached when given, or otherwise added to the builder of the field
+        cache when given.
+        The tokens are counted by counter.add() instead when given, i.e. a
+        sketch or an ExternalCounter.
+        The values of the fields are converted by the pipelines of --convert.
     """
     stat = dict()
+    fields = field_converters(args.fields or (), args.converts)
 
     cnt = 0
-    def add_token(token):
+    if resume is not None:
+        stat, cnt = resume['stat'], resume['cnt']
+
+    def save_checkpoint():
+        if ckpt is not None and ckpt.due():
+            ckpt.save(dict(sources=args.sources, position=instream.get_state(),
+                cnt=cnt, stat=stat))
+
+    def count_token(token):
         if token in stat:
             stat[token] += 1
         else:
             stat[token] = 1
 
-    if args.intype == 'json':
-        for line in instream:
-            cnt += 1
+    add_token = count_token if counter is None else counter.add
+
+    if args.intype == 'json' and cached is not None:
+        for src in args.sources:
+            readers = [cached.open(src, idx) for idx in args.fields]
             try:
-                jobj = json.loads(line)
-                for idx in args.fields:
-                    add_token(jobj[idx])
-            except KeyError as e:
-                logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
-                if not args.ignore_index_error and not args.ignore_error:
-                    exit(1)
-            except ValueError as e:
-                logging.error('Failed at [%s]: %s' % (cnt, str(e)))
-                if not args.ignore_error:
-                    exit(1)
+                for entries in fieldcache.iter_entries(readers):
+                    cnt += 1
+                    kind, data = entries[0]
+                    if kind == fieldcache.MALFORMED:
+                        logging.error('Failed at [%s]: %s' % (cnt, data))
+                        if not args.ignore_error:
+                            exit(1)
+                        continue
+                    for (idx, convert), (kind, data) in zip(fields, entries):
+                        if kind != fieldcache.VALUE:
+                            logging.error('[%s] Field Index Out of List: %s' % (cnt, str(KeyError(idx))))
+                            if not args.ignore_index_error and not args.ignore_error:
+                                exit(1)
+                            break
+                        add_token(convert(data) if convert else data)
+            finally:
+                for reader in readers:
+                    reader.close()
+
+    elif args.intype == 'json':
+        loads = jsonbackend.loads
+        for batch in read_batches(instream):
+            for line in batch:
+                cnt += 1
+                jobj = None
+                try:
+                    jobj = loads(line)
+                    if builder is not None:
+                        builder.add(instream, jobj)
+                    for idx, convert in fields:
+                        token = jobj[idx]
+                        add_token(convert(token) if convert else token)
+                except KeyError as e:
+                    logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
+                    if not args.ignore_index_error and not args.ignore_error:
+                        exit(1)
+                except ValueError as e:
+                    logging.error('Failed at [%s]: %s' % (cnt, str(e)))
+                    if builder is not None and jobj is None:
+                        builder.add(instream, None, str(e))
+                    if not args.ignore_error:
+                        exit(1)
+            save_checkpoint()
 
     elif args.intype == 'csv':
-        for line in instream:
-            cnt += 1
-            try:
-                datarow = line.strip().split(args.delimiter)
-                for idx in args.fields:
-                    add_token(datarow[idx])
-            except IndexError as e:
-                logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
-                if not args.ignore_index_error and not args.ignore_error:
-                    exit(1)
-            except Exception as e:
-                logging.error('Failed at [%s]: %s' % (cnt, str(e)))
-                if not args.ignore_error:
-                    exit(1)
+        for batch in read_batches(instream):
+            for line in batch:
+                cnt += 1
+                try:
+                    datarow = line.strip().split(args.delimiter)
+                    for idx, convert in fields:
+                        token = datarow[idx]
+                        add_token(convert(token) if convert else token)
+                except IndexError as e:
+                    logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
+                    if not args.ignore_index_error and not args.ignore_error:
+                        exit(1)
+                except Exception as e:
+                    logging.error('Failed at [%s]: %s' % (cnt, str(e)))
+                    if not args.ignore_error:
+                        exit(1)
+            save_checkpoint()
 
     else:
-        for line in instream:
+        for batch in read_batches(instream):
+            for line in batch:
+                cnt += 1
+                try:
+                    datarow = line.strip()
+                    add_token(datarow)
+                except Exception as e:
+                    logging.error('Failed at [%s]: %s' % (cnt, str(e)))
+                    if not args.ignore_error:
+                        exit(1)
+            save_checkpoint()
+    return stat
+
+def _field_value(item, field):
+    """ Return the value of a field of an item, or None if it is missing
+    """
+    try:
+        return item[field]
+    except (KeyError, IndexError):
+        return None
+
+def _iter_items(instream, args):
+    """ Iterate over (line number, JSON object or CSV row, error) of the
+        lines, where error is the exception of a malformed line
+    """
+    loads = jsonbackend.loads
+    cnt = 0
+    for batch in read_batches(instream):
+        for line in batch:
             cnt += 1
             try:
-                datarow = line.strip()
-                add_token(datarow)
-            except Exception as e:
-                logging.error('Failed at [%s]: %s' % (cnt, str(e)))
-                if not args.ignore_error:
-                    exit(1)
+                if args.intype == 'json':
+                    yield cnt, loads(line), None
+                else:
+                    yield cnt, line.strip().split(args.delimiter), None
+            except ValueError as e:
+                yield cnt, None, e
+
+def _item_fields(fields, args):
+    """ Return the fields as the indices of CSV rows with -t csv
+    """
+    if args.intype == 'csv':
+        return [None if field is None else int(field) for field in fields]
+    return fields
+
+def group_statistics(instream, args, grouping):
+    """ Aggregate the items of each group of the values of the --group-by
+        fields into grouping, see groupby.py. The fields are converted by
+        the pipelines of --convert and the errors are handled as in
+        discrete_statistics().
+    """
+    indexerror = _INDEXERRORS[args.intype]
+    lineerror = _LINEERRORS[args.intype]
+    keyfields = field_converters(_item_fields(args.groupby, args), args.converts)
+    valfields = _item_fields([agg.field for agg in grouping.aggregates], args)
+    for cnt, item, error in _iter_items(instream, args):
+        try:
+            if error is not None:
+                raise error
+            key = tuple(convert(item[field]) if convert else item[field]
+                for field, convert in keyfields)
+            grouping.add(key, [None if field is None else _field_value(item, field)
+                for field in valfields])
+        except indexerror as e:
+            logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
+            if not args.ignore_index_error and not args.ignore_error:
+                exit(1)
+        except lineerror as e:
+            logging.error('Failed at [%s]: %s' % (cnt, str(e)))
+            if not args.ignore_error:
+                exit(1)
+
+def bucket_statistics(instream, args, table):
+    """ Count the values of the fields in the buckets of the --bucket-by
+        field into table, a groupby.BucketTable, in one pass. The fields
+        are converted by the pipelines of --convert and the errors are
+        handled as in discrete_statistics().
+    """
+    indexerror = _INDEXERRORS[args.intype]
+    lineerror = _LINEERRORS[args.intype]
+    fields = field_converters(_item_fields(args.fields, args), args.converts)
+    timefield = _item_fields([args.bucketby], args)[0]
+    bucketof = converter.Pipeline([BUCKETS[args.bucket]])
+    for cnt, item, error in _iter_items(instream, args):
+        try:
+            if error is not None:
+                raise error
+            bucket = bucketof(item[timefield])
+            for field, convert in fields:
+                token = item[field]
+                table.add((convert(token) if convert else token,), bucket)
+        except indexerror as e:
+            logging.error('[%s] Field Index Out of List: %s' % (cnt, str(e)))
+            if not args.ignore_index_error and not args.ignore_error:
+                exit(1)
+        except lineerror as e:
+            logging.error('Failed at [%s]: %s' % (cnt, str(e)))
+            if not args.ignore_error:
+                exit(1)
+
+def print_table(rows, nrows, keynames, names, args, header=False):
+    """ Print the rows (key, number of items, values) of the groups or the
+        buckets as TSV, with the names as the header if header, or as
+        line-JSON, sorted by the number of items with -F or by the keys with
+        -K
+    """
+    if args.sortf:
+        rows = heapq.nlargest(args.top or nrows, rows, key=lambda x: (x[1], x[0]))
+    elif args.sortk:
+        rows = heapq.nsmallest(args.top or nrows, rows)
+    else:
+        rows = itertools.islice(rows, args.top)
+    if header and args.outformat == 'tsv':
+        print >> sys.stdout, u'\t'.join([u''] * len(keynames) + names).encode('utf-8')
+    for key, _, values in rows:
+        if args.outformat == 'json':
+            obj = collections.OrderedDict(zip(keynames, key))
+            obj.update(zip(names, values))
+            print >> sys.stdout, jsonbackend.dumps(obj)
+        else:
+            print >> sys.stdout, u'\t'.join(unicode(val) for val in
+                    list(key) + values).encode('utf-8')
+
+def _init_worker(settings):
+    """ Set up the JSON backend once in each worker process
+    """
+    global _SETTINGS
+    jsonbackend.use(settings['json_backend'])
+    _SETTINGS = settings
+
+def _count_task(task):
+    """ Count the tokens of one input file or file range in a worker
+        process into a Counter, or a sketch with --approx.
+        The errors are tagged with the line numbers local to the range, so
+        that the parent can renumber them as in a serial run. The counting
+        stops at the first error which is not ignored.
+    """
+    idx, src = task
+    settings = _SETTINGS
+    intype = settings['intype']
+    fields = field_converters(settings['fields'] or (), settings['converts'])
+    indexerror = _INDEXERRORS.get(intype, ())
+    lineerror = _LINEERRORS[intype]
+    loads = jsonbackend.loads
+    if settings['sketch'] is not None:
+        stat = new_sketch(settings['sketch'])
+        add_token = stat.add
+    else:
+        stat = collections.Counter()
+        def add_token(token):
+            stat[token] += 1
+    errors = list()
+    fatal = False
+    cnt = 0
+    fin = FileInputSet([src])
+    try:
+        for batch in read_batches(fin):
+            for line in batch:
+                cnt += 1
+                try:
+                    if intype == 'json':
+                        jobj = loads(line)
+                        for field, convert in fields:
+                            token = jobj[field]
+                            add_token(convert(token) if convert else token)
+                    elif intype == 'csv':
+                        datarow = line.strip().split(settings['delimiter'])
+                        for field, convert in fields:
+                            token = datarow[field]
+                            add_token(convert(token) if convert else token)
+                    else:
+                        add_token(line.strip())
+                except indexerror as e:
+                    errors.append((cnt, '[%s] Field Index Out of List: %s', str(e)))
+                    fatal = not settings['ignore_index_error'] and not settings['ignore_error']
+                except lineerror as e:
+                    errors.append((cnt, 'Failed at [%s]: %s', str(e)))
+                    fatal = not settings['ignore_error']
+                if fatal:
+                    return idx, stat, cnt, errors, fatal
+    finally:
+        fin.close()
+    return idx, stat, cnt, errors, fatal
+
+def parallel_statistics(args, counter=None):
+    """ Count the tokens of the input files with a pool of worker processes
+        Each worker counts a whole compressed file or a range of a plain file
+        and the parent merges the Counters, or the Counters or the sketches
+        into counter.merge() when given. The errors are reported with the
+        line numbers counted over all the files as in a serial run, and the
+        parent exits at the first error not ignored.
+    """
+    settings = dict(intype=args.intype, fields=args.fields, converts=args.converts,
+            delimiter=args.delimiter, json_backend=args.json_backend,
+            ignore_error=args.ignore_error,
+            ignore_index_error=args.ignore_index_error,
+            sketch=sketch_settings(args) if args.approx else None)
+    tasks = list(enumerate(split_sources(args.sources, args.chunksize << 20)))
+    pool = multiprocessing.Pool(args.jobs, _init_worker, (settings,))
+    stat = collections.Counter()
+    base = 0
+    try:
+        for _, part, nlines, errors, fatal in pool.imap(_count_task, tasks):
+            for lineno, fmt, msg in errors:
+                logging.error(fmt % (base + lineno, msg))
+            if fatal:
+                exit(1)
+            if counter is not None:
+                counter.merge(part)
+            else:
+                stat.update(part)
+            base += nlines
+    finally:
+        pool.terminate()
+        pool.join()
     return stat
 
 def parse_parameter():
@@ -92,55 +419,336 @@ def parse_parameter():
             help='Output the statistics with sorting on frequency.')
     parser.add_argument('-K', '--sort-key', action='store_true', default=False, dest='sortk',
             help='Output the statistics with sorting on key.')
+    parser.add_argument('-c', '--convert', action='append', default=list(),
+            dest='converts', metavar='FIELD:CONVERTER[:CONVERTER...]',
+            help='Convert the values of a field with a pipeline of converters '
+            'before counting them, e.g. -c created_at:TT2DayConverter, see '
+            'converter.py.')
+    parser.add_argument('--bucket-by', action='store', default=None,
+            dest='bucketby', metavar='FIELD', help='Count the values of the '
+            'fields in the buckets of the tweet time in FIELD as a table of a '
+            'row for each value and a column for each bucket.')
+    parser.add_argument('--bucket', action='store', default='day',
+            dest='bucket', choices=list(BUCKETS), help='The buckets of '
+            '--bucket-by.')
+    parser.add_argument('-g', '--group-by', action='append', default=list(),
+            dest='groupby', metavar='FIELD', help='Group the items by the values '
+            'of the fields instead of counting the values, e.g. -g user -g lang '
+            'for the pairs of them.')
+    parser.add_argument('-a', '--aggregate', action='append', default=list(),
+            dest='aggregates', metavar='FUNC[:FIELD]', help='Aggregate the items '
+            'of each group of --group-by, where FUNC is count, sum, min, max, '
+            'mean, median or pNN (the NN-th percentile, estimated), e.g. '
+            '-a count -a mean:retweets -a p99:retweets. Only count by default.')
+    parser.add_argument('--format', action='store', default='tsv',
+            dest='outformat', choices=['tsv', 'json'], help='The output format '
+            'of --group-by and --bucket-by.')
+    parser.add_argument('--top', action='store', type=int, default=None,
+            dest='top', metavar='K', help='Only output the first K tokens, '
+            'which are found without sorting all the tokens with -F or -K.')
     parser.add_argument('-X', '--ignore-index-error', action='store_true', default=False,
             dest='ignore_index_error',
             help='Ignore the errors when then field index doesn\'t exist')
     parser.add_argument('-E', '--ignore-error', action='store_true', default=False,
             dest='ignore_error',
             help='Ignore all the errors when doing statistics')
+    parser.add_argument('--json-backend', action='store', default='json',
+            dest='json_backend', choices=jsonbackend.BACKENDS,
+            help='The JSON library used for decoding the input, see '
+            'jsonbackend.py.')
+    parser.add_argument('--checkpoint', action='store', default=None,
+            dest='checkpoint', metavar='FILE',
+            help='Save the progress to FILE regularly and continue from it when '
+            'FILE exists, e.g. after a failure. FILE is removed once finished.')
+    parser.add_argument('--checkpoint-interval', action='store', type=float,
+            default=checkpoint.DEFAULT_INTERVAL, dest='checkpoint_interval',
+            metavar='SEC', help='Save the checkpoint every SEC seconds.')
+    parser.add_argument('--jobs', action='store', type=int, default=1,
+            dest='jobs', metavar='N', help='Count the input files with N worker '
+            'processes and merge their counts.')
+    parser.add_argument('--chunk-size', action='store', type=int, default=64,
+            dest='chunksize', metavar='MB', help='With --jobs, plain input files '
+            'larger than MB megabytes are split into ranges counted by several '
+            'workers.')
+    parser.add_argument('--approx', action='store', default=None,
+            dest='approx', choices=sorted(sketches.SKETCHES),
+            help='Count the tokens approximately in fixed memory: the most '
+            'frequent tokens by Space-Saving or Count-Min, or the number of '
+            'distinct tokens by HyperLogLog (hll). See sketches.py for the '
+            'error bounds.')
+    parser.add_argument('--counters', action='store', type=int, default=10000,
+            dest='counters', metavar='NUM', help='Keep NUM tokens for '
+            'Space-Saving. The counts are over-estimated by at most 1/NUM of '
+            'all the tokens.')
+    parser.add_argument('--cms-width', action='store', type=int, default=1 << 16,
+            dest='cms_width', metavar='NUM', help='Use NUM counters in each row '
+            'of Count-Min. The counts are over-estimated by at most e/NUM of all '
+            'the tokens with a probability of 1 - exp(-DEPTH).')
+    parser.add_argument('--cms-depth', action='store', type=int, default=4,
+            dest='cms_depth', metavar='DEPTH', help='Use DEPTH rows of counters for Count-Min.')
+    parser.add_argument('--hll-precision', action='store', type=int, default=14,
+            dest='hll_precision', metavar='P', help='Use 2^P registers for '
+            'HyperLogLog with a standard error of 1.04/sqrt(2^P).')
+    parser.add_argument('--save-sketch', action='store', default=None,
+            dest='save_sketch', metavar='FILE', help='Save the sketch of --approx '
+            'to FILE for merging it later with --merge-sketch.')
+    parser.add_argument('--merge-sketch', action='append', default=list(),
+            dest='merge_sketch', metavar='FILE', help='Merge a sketch saved with '
+            '--save-sketch of the same --approx and sizes. STDIN is not read '
+            'when no input file is given.')
+    parser.add_argument('--memory', action='store', type=int, default=None,
+            dest='memory', metavar='MB', help='Count exactly with about MB '
+            'megabytes of counts in memory, spilling them to temporary files when '
+            'there are more tokens.')
+    parser.add_argument('--tmp-dir', action='store', default=None,
+            dest='tmpdir', metavar='DIR', help='Write the temporary files of '
+            '--memory in DIR.')
+    parser.add_argument('--partitions', action='store', type=int,
+            default=extcounter.DEFAULT_PARTITIONS, dest='partitions', metavar='NUM',
+            help='Split the counts spilled by --memory into NUM partitions by '
+            'the hashes of the tokens.')
+    parser.add_argument('--cache-dir', action='store', default=None,
+            dest='cachedir', metavar='DIR',
+            help='Cache the values of the fields of JSON input files in DIR, and '
+            'use them instead of decoding the lines when all of them are cached, '
+            'e.g. %s.' % (fieldcache.DEFAULT_CACHEDIR,))
+    parser.add_argument('--cache-size', action='store', type=int,
+            default=fieldcache.DEFAULT_BUDGET, dest='cachesize', metavar='MB',
+            help='Remove the least recently used values when the cache is '
+            'larger than MB megabytes.')
+    parser.add_argument('--debug', action='store_true', default=False,
+            dest='debug', help='Log debug information, e.g. the use of the cache.')
     parser.add_argument('sources', metavar='file', nargs='*',
             help='Files as inputs. STDIN will be used, if no input file specified.')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.intype == 'csv':
+        # the fields of CSV rows are the indices of the columns
+        fields = list(args.groupby)
+        for spec in args.aggregates:
+            m = groupby.AGGREGATE.match(spec)
+            if m is not None and m.group('field') is not None:
+                fields.append(m.group('field'))
+        if args.bucketby is not None:
+            fields.append(args.bucketby)
+            fields.extend(args.fields or ())
+        for field in fields:
+            try:
+                int(field)
+            except ValueError:
+                parser.error('The fields of -t csv should be column indices: %s' % (field,))
+    return args
 
 def main():
     """ main()
     """
     args = parse_parameter()
     logging.basicConfig(format='[%(levelname)s] %(message)s',
-                        level=logging.INFO)
+                        level=logging.DEBUG if args.debug else logging.INFO)
     logging.debug(args)
+    try:
+        jsonbackend.use(args.json_backend)
+    except ImportError as e:
+        logging.error('JSON backend %s is not available: %s' % (args.json_backend, e))
+        exit(1)
+
+    if args.converts and args.intype is None:
+        logging.error('--convert needs -t json or csv')
+        exit(1)
+    try:
+        field_converters((), args.converts)
+    except (ValueError, AttributeError) as e:
+        logging.error('Failed to create the converters of %s: %s' % (args.converts, e))
+        exit(1)
+
+    grouping, table = None, None
+    if args.groupby or args.bucketby:
+        if args.intype is None or args.approx or args.memory is not None \
+                or args.checkpoint or args.jobs > 1 or args.cachedir:
+            logging.error('--group-by and --bucket-by need -t json or csv and '
+                    'do not work with --approx, --memory, --checkpoint, --jobs '
+                    'or --cache-dir')
+            exit(1)
+    if args.groupby and args.bucketby:
+        logging.error('--group-by and --bucket-by can not be used together')
+        exit(1)
+    if args.bucketby:
+        if args.fields is None:
+            logging.error('No fields specified for --bucket-by')
+            exit(1)
+        table = groupby.BucketTable()
+    if args.groupby:
+        try:
+            grouping = groupby.GroupBy([groupby.parse_aggregate(spec)
+                for spec in args.aggregates or ['count']])
+        except ValueError as e:
+            logging.error(str(e))
+            exit(1)
+    elif args.aggregates:
+        logging.error('--aggregate needs --group-by')
+        exit(1)
+
+    sketch = None
+    if args.approx:
+        try:
+            sketch = new_sketch(sketch_settings(args))
+        except ValueError as e:
+            logging.error(str(e))
+            exit(1)
+    elif args.save_sketch or args.merge_sketch:
+        logging.error('--save-sketch and --merge-sketch need --approx')
+        exit(1)
+    if args.chunksize < 1:
+        logging.error('--chunk-size should be positive')
+        exit(1)
+    if args.memory is not None and (args.approx or args.memory <= 0 or args.partitions <= 0):
+        logging.error('--memory should be positive and does not work with --approx')
+        exit(1)
+
+    ckpt, resume = None, None
+    if args.checkpoint:
+        if len(args.sources) == 0 or args.jobs > 1 or sketch is not None \
+                or args.memory is not None:
+            logging.error('--checkpoint only works with input files without '
+                    '--jobs, --approx or --memory')
+            exit(1)
+        ckpt = checkpoint.Checkpoint(args.checkpoint, args.checkpoint_interval)
+        try:
+            resume = ckpt.load()
+        except (IOError, ValueError) as e:
+            logging.error('Failed to load the checkpoint: %s' % (e,))
+            exit(1)
+        if resume is not None and resume['sources'] != args.sources:
+            logging.error('The checkpoint is of statistics of other files')
+            exit(1)
 
 	# Determine the input of JSON streams
     if len(args.sources) > 0:
-        fin = FileInputSet(args.sources)
+        fin = FileInputSet(args.sources,
+                resume=resume['position'] if resume is not None else None)
     else:
         fin = sys.stdin
 
+    if grouping is not None:
+        group_statistics(fin, args, grouping)
+        print_table(grouping.iteritems(), len(grouping.groups), args.groupby,
+                [agg.spec for agg in grouping.aggregates], args)
+        return
+    if table is not None:
+        bucket_statistics(fin, args, table)
+        print_table(table.iteritems(), len(table.rows), ['token'], table.buckets(),
+                args, header=True)
+        return
+
     if args.intype == 'json' and args.fields == None:
         logging.error('No fields specified for processing for a json input')
         exit(1)
     if args.intype == 'csv' and args.fields == None:
         args.fields = [0,]
 
+    cache, cached, builder = None, None, None
+    if args.cachedir:
+        if args.intype != 'json' or len(args.sources) == 0 or ckpt is not None \
+                or args.jobs > 1:
+            logging.warn('The field cache is only used for JSON input files '
+                    'without --checkpoint or --jobs')
+        elif not all(cacheable_field(idx) for idx in args.fields):
+            logging.warn('The field cache can not be used with the fields given')
+        else:
+            cache = fieldcache.FieldCache(args.cachedir, args.cachesize << 20)
+            missing = cache.find(args.sources, args.fields)
+            if not missing:
+                cached = cache
+            else:
+                builder = fieldcache.FieldCacheBuilder(cache, missing,
+                        dict((idx, lambda jobj, idx=idx: jobj[idx]) for idx in args.fields))
+
+    counter = sketch
+    if args.memory is not None:
+        counter = extcounter.ExternalCounter(args.memory << 20, args.tmpdir,
+                args.partitions)
+
     # Do statistics
-    stat = discrete_statistics(fin, args)
+    complete = False
+    try:
+        if len(args.sources) == 0 and args.merge_sketch:
+            stat = dict()
+        elif args.jobs > 1 and len(args.sources) > 0:
+            stat = parallel_statistics(args, counter)
+        else:
+            stat = discrete_statistics(fin, args, ckpt, resume, cached, builder, counter)
+        complete = True
+    finally:
+        if builder is not None:
+            # the values of files partly read are not cached
+            builder.close(complete)
+    if cache is not None:
+        cache.evict()
+        cache.report()
+
+    if sketch is not None:
+        for path in args.merge_sketch:
+            try:
+                other = sketches.load(path)
+                if type(other) is not type(sketch):
+                    raise ValueError('%s is not a sketch of --approx %s' % (path, args.approx))
+                sketch.merge(other)
+            except (IOError, EOFError, ValueError) as e:
+                logging.error('Failed to merge the sketch: %s' % (e,))
+                exit(1)
+        if args.save_sketch:
+            sketches.save(sketch, args.save_sketch)
+        if isinstance(sketch, sketches.HyperLogLog):
+            print >> sys.stdout, sketch.count()
+            return
+        stat = sketch.top(args.top)
+        if args.sortk:
+            stat.sort()
+        for key, val in stat:
+            print >> sys.stdout, key + '\t' + str(val)
+        return
+
+    if isinstance(counter, extcounter.ExternalCounter):
+        try:
+            if args.sortf:
+                if args.top is not None:
+                    stat = counter.top_by_count(args.top)
+                else:
+                    stat = counter.iter_by_count()
+            elif args.sortk:
+                stat = itertools.islice(counter.iter_by_token(), args.top)
+            else:
+                stat = itertools.islice(counter.iteritems(), args.top)
+            for key, val in stat:
+                print >> sys.stdout, key + '\t' + str(val)
+        finally:
+            counter.close()
+        logging.debug('Spilled %d times' % (counter.spills,))
+        return
 
     # Sort results
     if args.sortf:
-        stat = [(v, k) for k, v in stat.iteritems()]
-        stat.sort()
-        stat.reverse()
+        if args.top is not None:
+            stat = heapq.nlargest(args.top, ((v, k) for k, v in stat.iteritems()))
+        else:
+            stat = [(v, k) for k, v in stat.iteritems()]
+            stat.sort()
+            stat.reverse()
         stat = [(k, v) for v, k in stat]
     elif args.sortk:
-        stat = [(k, v) for k, v in stat.iteritems()]
-        stat.sort()
+        if args.top is not None:
+            stat = heapq.nsmallest(args.top, stat.iteritems())
+        else:
+            stat = [(k, v) for k, v in stat.iteritems()]
+            stat.sort()
     else:
-        stat = [(k, v) for k, v in stat.iteritems()]
+        stat = itertools.islice(stat.iteritems(), args.top)
 
     # Print results
     for key, val in stat:
         print >> sys.stdout, key + '\t' + str(val)
+    if ckpt is not None:
+        ckpt.remove()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,344 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: test_tools.py
+Description:
+    Regression tests of the command line tools, run on the files in
+    testfile/ and generated line JSON files, e.g.
+        python -m unittest discover -s src -p 'test_*.py'
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import os
+import sys
+import gzip
+import json
+import shutil
+import select
+import tempfile
+import unittest
+import subprocess
+import jrep
+import converter
+import lineindex
+from cStringIO import StringIO
+from fileset import FileInputSet
+from batchwriter import BatchWriter
+from lineindex import build_index
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+TESTFILE = os.path.join(os.path.dirname(_HERE), 'testfile')
+
+
+def run_tool(tool, argv, stdin=None):
+    """ Run a tool in this directory and return (exit code, stdout, stderr)
+    """
+    proc = subprocess.Popen([sys.executable, os.path.join(_HERE, tool)] + argv,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate(stdin)
+    return proc.returncode, out, err
+
+
+class ToolTestCase(unittest.TestCase):
+    """ A test case with a temporary directory for generated files
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='jtool-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def write_lines(self, name, objs):
+        """ Write the objects as line JSON into the temporary directory
+        """
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fout:
+            for obj in objs:
+                if isinstance(obj, basestring):
+                    print >> fout, obj
+                else:
+                    print >> fout, json.dumps(obj)
+        return path
+
+
+class ParallelScanTest(ToolTestCase):
+    """ jrep --jobs gives the outputs of a serial run
+    """
+    def test_skip_numprint(self):
+        srcs = [self.write_lines('a.ljson', [{'id': i} for i in xrange(150)]),
+                self.write_lines('b.ljson', [{'id': i} for i in xrange(150, 300)])]
+        for window in [['--skip', '100'], ['--skip', '148', '-n', '5'],
+                ['--skip', '10', '-n', '200'], ['--ordered', '-N', '3'], ['-N', '155']]:
+            serial = run_tool('jrep.py', ['-f', 'id'] + window + srcs)
+            parallel = run_tool('jrep.py', ['-f', 'id', '--jobs', '2'] + window + srcs)
+            self.assertEqual(serial[1], parallel[1])
+            self.assertTrue(serial[1])
+        for tool, argv in [('jrep.py', ['-f', 'id']), ('stats.py', [])]:
+            for chunksize in ['0', '-1']:
+                code, out, err = run_tool(tool, argv + ['--jobs', '2', '--chunk-size',
+                    chunksize] + srcs)
+                self.assertNotEqual(code, 0)
+                self.assertIn('--chunk-size should be positive', err)
+            missing = os.path.join(self.tmpdir, 'missing.ljson')
+            serial = run_tool(tool, argv + ['-K'] * (tool == 'stats.py') + [missing] + srcs)
+            parallel = run_tool(tool, argv + ['-K'] * (tool == 'stats.py')
+                    + ['--jobs', '2', missing] + srcs)
+            self.assertEqual(sorted(serial[1].splitlines()), sorted(parallel[1].splitlines()))
+            self.assertTrue(parallel[1])
+            self.assertIn('No such file or directory', parallel[2])
+            self.assertNotIn('Traceback', parallel[2])
+        code, out, err = run_tool('jrep.py', ['-f', 'id', '--jobs', '2', '--skip', '100',
+            '-N', '5'] + srcs)
+        self.assertEqual(code, 2)
+        self.assertEqual(out, '')
+
+    def test_numprint_warnings(self):
+        objs = list()
+        for i in xrange(40000):
+            if i % 1000 == 999:
+                objs.append('{"id": %d, "lang": ' % (i,))
+            else:
+                objs.append({'id': i, 'lang': 'ja' if i % 7 == 0 else 'en',
+                    'text': 'x' * 40})
+        src = self.write_lines('a.ljson', objs)
+        for window in [['-N', '1500'], ['-N', '1500', '--ordered'], ['-N', '3000']]:
+            argv = ['-i', 'lang==ja', '-f', 'id'] + window + [src]
+            serial = run_tool('jrep.py', argv)
+            parallel = run_tool('jrep.py', ['--jobs', '4', '--chunk-size', '1'] + argv)
+            self.assertEqual(serial[1:], parallel[1:])
+            self.assertTrue(serial[2])
+
+
+class PrefilterTest(ToolTestCase):
+    """ jrep decodes and checks every line unless --prefilter is given
+    """
+    def test_default(self):
+        src = self.write_lines('a.ljson', [{'v': 1, 'id': 0}, '{"v": 1, "id": ',
+            {'v': True, 'id': 2}, {'v': 7, 'id': 3}, 'null,'])
+        code, out, err = run_tool('jrep.py', ['-i', 'v==1', '-f', 'id', src])
+        self.assertEqual(out, '0\n2\n')
+        self.assertEqual(len(err.splitlines()), 2)
+        code, out, err = run_tool('jrep.py', ['--prefilter', '-i', 'v==1', '-f', 'id', src])
+        self.assertEqual(out, '0\n')
+
+    def test_badjson(self):
+        src = os.path.join(TESTFILE, 'badjson.ljson')
+        code, out, err = run_tool('jrep.py', ['-i', 'id==1', '-f', 'id', src])
+        self.assertEqual(err, run_tool('jrep.py', ['-f', 'id', src])[2])
+
+
+class JSONBackendTest(ToolTestCase):
+    """ The lines are decoded by json unless another backend is asked for
+    """
+    def test_default(self):
+        src = self.write_lines('a.ljson', ['{"id": 123456789012345678901234567890}', 'null,'])
+        code, out, err = run_tool('jrep.py', ['-f', 'id', src])
+        self.assertEqual(out, '123456789012345678901234567890\n')
+        try:
+            json.loads('null,\n')
+        except ValueError as e:
+            self.assertIn(str(e), err)
+
+
+class GroupByTest(ToolTestCase):
+    """ stats --group-by aggregates the items of each group
+    """
+    def test_count_string_field(self):
+        src = self.write_lines('a.ljson', [{'lang': 'en', 'user': 'a', 'n': 1},
+            {'lang': 'en', 'n': 3}, {'lang': 'fr', 'user': 'b', 'n': 2}])
+        code, out, err = run_tool('stats.py', ['-t', 'json', '-g', 'lang', '-a', 'count',
+            '-a', 'count:user', '-a', 'sum:n', '-K', src])
+        self.assertEqual(code, 0)
+        self.assertEqual(err, '')
+        self.assertEqual(out, 'en\t2\t1\t4.0\nfr\t1\t1\t2.0\n')
+
+    def test_csv_fields(self):
+        src = self.write_lines('a.tsv', ['en\ta\t1', 'en\tb\t3', 'fr\ta\t2'])
+        code, out, err = run_tool('stats.py', ['-t', 'csv', '-g', '0', '-a', 'sum:2', '-K', src])
+        self.assertEqual(out, 'en\t4.0\nfr\t2.0\n')
+        for argv in [['-g', 'name'], ['-g', '0', '-a', 'sum:n']]:
+            code, out, err = run_tool('stats.py', ['-t', 'csv'] + argv + [src])
+            self.assertEqual(code, 2)
+            self.assertIn('column indices', err)
+            self.assertNotIn('Traceback', err)
+
+
+class GzipTest(ToolTestCase):
+    """ Corrupted gzip files are reported as by the gzip module
+    """
+    def test_badgzip(self):
+        srcs = [os.path.join(TESTFILE, 'badgzip.ljson.gz'),
+                os.path.join(TESTFILE, 'normal.ljson')]
+        code, out, err = run_tool('jrep.py', ['-f', 'id'] + srcs)
+        self.assertEqual(out, '1\n3\n3\n')
+        self.assertTrue(err.startswith('CRC check failed'))
+        self.assertTrue(err.rstrip().endswith('badgzip.ljson.gz[0]'))
+
+    def test_badgzip_sniffed(self):
+        src = os.path.join(self.tmpdir, 'badgzip.ljson')
+        shutil.copy(os.path.join(TESTFILE, 'badgzip.ljson.gz'), src)
+        srcs = [src, os.path.join(TESTFILE, 'normal.ljson')]
+        code, out, err = run_tool('jrep.py', ['-f', 'id'] + srcs)
+        self.assertEqual(out, '1\n3\n3\n')
+        self.assertEqual(err.split(' at ')[0], run_tool('jrep.py',
+            ['-f', 'id', os.path.join(TESTFILE, 'badgzip.ljson.gz')])[2].split(' at ')[0])
+        code, out, err = run_tool('stats.py', ['-t', 'json', '-f', 'name', '-K'] + srcs)
+        self.assertEqual(out, 'id=1\t1\nid=3\t2\n')
+        self.assertTrue(err.rstrip().endswith('badgzip.ljson[0]'))
+
+
+class ConditionOrderTest(ToolTestCase):
+    """ The first value reaching a condition converts its REFVAL, as in the
+        given order of the conditions
+    """
+    def test_mixed_types(self):
+        src = self.write_lines('a.ljson', [{'a': '1', 'id': 0},
+            {'a': 1, 'b': 1, 'id': 1}, {'a': '1', 'b': 1, 'id': 2},
+            {'a': 1, 'b': 1, 'id': 3}])
+        inset = 'a<<' + self.write_lines('set.txt', ['1', '2'])
+        for conds, expected in [(['-i', 'a==1', '-i', 'b'], '2\n'),
+                (['-i', 'b', '-i', 'a==1'], '1\n3\n'),
+                (['-i', inset, '-i', 'b'], ''),
+                (['-i', 'b', '-i', inset], '1\n3\n')]:
+            code, out, err = run_tool('jrep.py', conds + ['-f', 'id', src])
+            self.assertEqual(out, expected)
+            code, out, err = run_tool('jrep.py', ['--debug'] + conds + ['-f', 'id', src])
+            self.assertEqual(out, expected)
+
+
+class ResumeTest(ToolTestCase):
+    """ A scan skipping lines by the index continues from its saved state
+    """
+    def test_skip_indexed(self):
+        lines = ['{"id": %d}\n' % (i,) for i in xrange(1000)]
+        plain = self.write_lines('a.ljson', [l.rstrip() for l in lines])
+        gzipped = os.path.join(self.tmpdir, 'a.ljson.gz')
+        with open(gzipped, 'wb') as fout:
+            for i in xrange(0, 1000, 300):
+                member = gzip.GzipFile(fileobj=fout, mode='wb')
+                member.write(''.join(lines[i:i + 300]))
+                member.close()
+        for src in [plain, gzipped]:
+            build_index(src, 16)
+            for skip in [100, 450]:
+                fin = FileInputSet([src], skip)
+                batches = fin.iter_batches(512)
+                head = next(batches)
+                state = fin.get_state()
+                fin.close()
+                self.assertEqual(head[0], lines[skip])
+                rest = [l for b in FileInputSet([src], resume=state).iter_batches(512)
+                        for l in b]
+                self.assertEqual(head + rest, lines[skip:])
+
+
+class ConverterTest(ToolTestCase):
+    """ The rows before a row failing to convert are printed in both modes
+    """
+    def test_failing_row(self):
+        src = self.write_lines('a.tsv', ['Wed Feb 01 13:22:07 +0000 2012\ta',
+            'Thu Feb 02 13:22:07 +0000 2012\tb', 'bad time\tc',
+            'Fri Feb 03 13:22:07 +0000 2012\td'])
+        for mode in [[], ['--row-mode'], ['--block-rows', '2']]:
+            code, out, err = run_tool('converter.py', mode + ['-f', '0:TT2DayConverter', src])
+            self.assertEqual(code, 1)
+            self.assertEqual(out, '2012-02-01\ta\n2012-02-02\tb\n')
+            self.assertEqual(len(err.splitlines()), 1)
+
+    def test_first_failing_row(self):
+        src = self.write_lines('a.tsv', ['Wed Feb 01 13:22:07 +0000 2012\t' * 2,
+            'Wed Feb 01 13:22:07 +0000 2012\tbad second', 'bad first\t' * 2])
+        argv = ['-f', '0:TT2DayConverter', '-f', '1:TT2DayConverter', src]
+        expected = run_tool('converter.py', ['--row-mode'] + argv)
+        self.assertIn('second', expected[2])
+        self.assertEqual(run_tool('converter.py', argv), expected)
+
+    def test_pipe(self):
+        proc = subprocess.Popen([sys.executable, '-u', os.path.join(_HERE, 'converter.py'),
+            '-f', '0:TT2DayConverter'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            proc.stdin.write('Wed Feb 01 13:22:07 +0000 2012\ta\n' * 3)
+            proc.stdin.flush()
+            # the lines are converted before the input ends
+            ready = select.select([proc.stdout], [], [], 30)[0]
+            self.assertTrue(ready)
+            self.assertEqual(proc.stdout.readline(), '2012-02-01\ta\n')
+        finally:
+            proc.stdin.close()
+            proc.stdout.read()
+            proc.wait()
+
+    def test_twittertime(self):
+        for timestr in ['Wed Feb 01 13:22:07 +0000 2012', 'Wed Feb 01 13:22:07 +0000 2012\n',
+                'Wed Feb 30 13:22:07 +0000 2012', 'Wed Foo 01 13:22:07 +0000 2012']:
+            try:
+                expected = converter.datetime.strptime(timestr[4:], converter.TWITTERTIMEFORMAT)
+            except ValueError:
+                self.assertRaises(SystemExit, converter.twittertime, timestr)
+            else:
+                self.assertEqual(converter.twittertime(timestr), expected)
+
+
+class CheckpointTest(ToolTestCase):
+    """ A checkpoint failed to load is reported without a traceback
+    """
+    def test_corrupted(self):
+        src = self.write_lines('a.ljson', [{'id': 0}])
+        for content in ['garbage', '', '(dp0']:
+            ckpt = self.write_lines('ckpt', [content])
+            for tool, argv in [('stats.py', ['-t', 'json', '-f', 'id']),
+                    ('jrep.py', ['-f', 'id'])]:
+                code, out, err = run_tool(tool, argv + ['--checkpoint', ckpt, src])
+                self.assertEqual(code, 2 if tool == 'jrep.py' else 1)
+                self.assertIn('Failed to load the checkpoint', err)
+                self.assertNotIn('Traceback', err)
+
+
+class ZoneMapTest(ToolTestCase):
+    """ The blocks selected by zone maps are read from a gzip file opened once
+    """
+    def test_single_member(self):
+        src = os.path.join(self.tmpdir, 'a.ljson.gz')
+        with gzip.open(src, 'wb') as fout:
+            for i in xrange(5000):
+                fout.write(json.dumps({'id': i, 'v': i if i // 100 % 5 == 0 else -i}) + '\n')
+        run_tool('jrep.py', ['--build-zonemap', 'v', '--zonemap-block', '50', src])
+        expected = ''.join('%d\n' % (i,) for i in xrange(5000) if i // 100 % 5 == 0)
+        code, out, err = run_tool('jrep.py', ['-i', 'v>=0', '-f', 'id', src])
+        self.assertEqual(out, expected)
+        opened = list()
+        open_position = lineindex.open_position
+        def counted(*args):
+            opened.append(args)
+            return open_position(*args)
+        lineindex.open_position = counted
+        try:
+            cond = jrep.MatchCondition('v>=0', True, 'NULL')
+            cond.refval = 0
+            lines = list(jrep.iter_zones(jrep.zone_map_lookup([src], [cond])))
+        finally:
+            lineindex.open_position = open_position
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(len(opened), 1)
+
+
+class BatchWriterTest(unittest.TestCase):
+    """ BatchWriter closes the file only if it is asked to
+    """
+    def test_closing(self):
+        for background in [False, True]:
+            fout = StringIO()
+            writer = BatchWriter(fout, 4, background, closing=False)
+            for data in ['a\n', 'bc\n', 'd\n']:
+                writer.write(data)
+            writer.close()
+            self.assertEqual(fout.getvalue(), 'a\nbc\nd\n')
+            writer = BatchWriter(fout, 4, background)
+            writer.close()
+            self.assertRaises(ValueError, fout.getvalue)
+
+
+if __name__ == '__main__':
+    unittest.main()
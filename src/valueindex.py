@@ -0,0 +1,194 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: valueindex.py
+Description:
+    Sidecar inverted index from the values under an element path to the
+    positions of the lines holding them, for answering == and << conditions
+    without scanning the whole file.
+    The index of FILE for PATH is stored in FILE.PATH.jvix. It is a sorted
+    array of fixed-size records (value hash, line number, member offset,
+    offset in member) which is memory-mapped and binary-searched, so a
+    lookup does not load the index. Values are hashed by their text, see
+    value_key(), so the lines found are candidates to be checked by the
+    conditions. Malformed lines are recorded and returned by every lookup,
+    so that they are still reported.
+    An index is ignored with a warning when the size or the modification
+    time of the file has changed since the index was built.
+History:
+    0.1.0 The first version.
+"""
+__version__ = '0.1.0'
+__author__ = 'SpaceLis'
+
+import os
+import mmap
+import struct
+import hashlib
+import logging
+from lineindex import iter_lines
+
+INDEXSUFFIX = '.jvix'
+
+# magic, version, file size, file mtime, number of lines, number of
+# malformed lines, number of records, length of the path
+_HEADER = struct.Struct('<4sIQdQQQI')
+# value hash, line number, member offset, offset in member
+_RECORD = struct.Struct('<QQQQ')
+# line number, member offset, offset in member
+_BADLINE = struct.Struct('<QQQ')
+_MAGIC = 'JVIX'
+_VERSION = 1
+
+
+def index_path(src, path):
+    """ Return the path of the index of src for the element path
+    """
+    return '%s.%s%s' % (src, path, INDEXSUFFIX)
+
+def value_key(val):
+    """ Return the text of a JSON value to be hashed
+        Numbers equal in Python have the same text, e.g. 3 and 3.0.
+        Return None for values which can not be indexed.
+    """
+    if isinstance(val, bool) or val is None:
+        return None
+    if isinstance(val, (int, long)):
+        return str(val)
+    if isinstance(val, float):
+        return str(int(val)) if val.is_integer() else repr(val)
+    if isinstance(val, unicode):
+        return val.encode('utf-8')
+    if isinstance(val, str):
+        return val
+    return None
+
+def refval_keys(refval):
+    """ Return the texts of the values a REFVAL string may be equal to
+        after being converted to the type of the values
+    """
+    keys = set([refval, refval.strip()])
+    try:
+        keys.add(value_key(int(refval)))
+    except ValueError:
+        pass
+    try:
+        keys.add(value_key(float(refval)))
+    except ValueError:
+        pass
+    keys.discard(None)
+    return keys
+
+def hash_key(key):
+    """ Hash the text of a value into 64 bits
+    """
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+def build_value_index(src, path, parse, loads):
+    """ Build the index of src for the element path and write it to the
+        sidecar file. parse() extracts the value from a decoded line.
+        Return False without writing the index if some values can not be
+        indexed, e.g. lists or booleans.
+    """
+    stat = os.stat(src)
+    records, badlines = list(), list()
+    nlines = 0
+    for member, offset, line in iter_lines(src):
+        try:
+            val = parse(loads(line))
+        except KeyError:
+            continue
+        except ValueError:
+            badlines.append((nlines, member, offset))
+            continue
+        finally:
+            nlines += 1
+        key = value_key(val)
+        if key is None:
+            logging.warn('Value %r of %s at %s[%d] can not be indexed' %
+                    (val, path, src, nlines))
+            return False
+        records.append((hash_key(key), nlines - 1, member, offset))
+    records.sort()
+    tmppath = index_path(src, path) + '.tmp'
+    with open(tmppath, 'wb') as fout:
+        fout.write(_HEADER.pack(_MAGIC, _VERSION, stat.st_size, stat.st_mtime,
+            nlines, len(badlines), len(records), len(path)))
+        fout.write(path)
+        for badline in badlines:
+            fout.write(_BADLINE.pack(*badline))
+        for record in records:
+            fout.write(_RECORD.pack(*record))
+    os.rename(tmppath, index_path(src, path))
+    return True
+
+
+class ValueIndex(object):
+    """ The memory-mapped value index of a file, see build_value_index()
+    """
+    def __init__(self, src, path, nlines, nbad, nrecords, mm, start):
+        super(ValueIndex, self).__init__()
+        self.src = src
+        self.path = path
+        self.nlines = nlines
+        self._nbad = nbad
+        self._nrecords = nrecords
+        self._mm = mm
+        self._badstart = start
+        self._start = start + nbad * _BADLINE.size
+
+    @classmethod
+    def load(cls, src, path):
+        """ Load the index of src for path, or return None if there is no
+            index or the index is out of date.
+        """
+        ipath = index_path(src, path)
+        if not os.path.exists(ipath):
+            return None
+        with open(ipath, 'rb') as fin:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, mtime, nlines, nbad, nrecords, pathlen = \
+                _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            logging.warn('Unknown value index format of %s' % (ipath,))
+            return None
+        stat = os.stat(src)
+        if stat.st_size != size or stat.st_mtime != mtime:
+            logging.warn('Value index %s is out of date, rebuild it with '
+                    '--build-value-index' % (ipath,))
+            return None
+        return cls(src, path, nlines, nbad, nrecords, mm, _HEADER.size + pathlen)
+
+    def _hash_at(self, i):
+        """ Return the hash of the i-th record
+        """
+        return _RECORD.unpack_from(self._mm, self._start + i * _RECORD.size)[0]
+
+    def _lookup_hash(self, hval):
+        """ Yield (line number, member offset, offset) of a hash value
+        """
+        lo, hi = 0, self._nrecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._hash_at(mid) < hval:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self._nrecords:
+            record = _RECORD.unpack_from(self._mm, self._start + lo * _RECORD.size)
+            if record[0] != hval:
+                break
+            yield record[1:]
+            lo += 1
+
+    def lookup(self, refvals):
+        """ Return the sorted positions (line number, member offset, offset)
+            of the lines which may hold one of the REFVAL strings, together
+            with the malformed lines.
+        """
+        positions = set()
+        for refval in refvals:
+            for key in refval_keys(refval):
+                positions.update(self._lookup_hash(hash_key(key)))
+        for i in xrange(self._nbad):
+            positions.add(_BADLINE.unpack_from(self._mm, self._badstart + i * _BADLINE.size))
+        return sorted(positions)
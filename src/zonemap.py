@@ -0,0 +1,215 @@
+#!python
+# -*- coding: utf-8 -*-
+"""File: zonemap.py
+Description:
+    Zone maps, i.e. the minimum and the maximum values under an element path
+    for each block of lines of a file, for skipping the blocks which can not
+    fulfill the range conditions (<=, >=) and == of jrep.
+    The zone map of FILE for PATH is stored in FILE.PATH.jzmap as JSON. Each
+    block records the position of its first line as (member offset, offset in
+    member), so that the blocks of gzip files can be entered at their gzip
+    member, see lineindex.py.
+    A zone map can only be used when all the values are of one type (int,
+    float or string). Blocks with malformed lines are never skipped, so that
+    those lines are still reported.
+    A zone map is ignored with a warning when the size or the modification
+    time of the file has changed since the zone map was built.
+History:
+    0.1.1 x skipping files which can not be indexed
+    0.1.0 The first version.
+"""
+__version__ = '0.1.1'
+__author__ = 'SpaceLis'
+
+import os
+import json
+import logging
+
+ZONEMAPSUFFIX = '.jzmap'
+DEFAULT_BLOCKLINES = 4096
+_VERSION = 1
+
+
+def zonemap_path(src, path):
+    """ Return the path of the zone map of src for the element path
+    """
+    return '%s.%s%s' % (src, path, ZONEMAPSUFFIX)
+
+def value_type(val):
+    """ Return the name of the type of a value for zone maps
+    """
+    if isinstance(val, bool) or val is None:
+        return 'other'
+    if isinstance(val, (int, long)):
+        return 'int'
+    if isinstance(val, float):
+        return 'float'
+    if isinstance(val, basestring):
+        return 'str'
+    return 'other'
+
+
+class ZoneMapBuilder(object):
+    """ Build the zone maps of the files read in a normal pass for the paths
+        Call add() for each line in the order of reading with the
+        FileInputSet (created with track=True) and the decoded object, or
+        None for malformed lines. The zone map of a file is written once the
+        whole file is read.
+    """
+    def __init__(self, paths, parses, blocklines=DEFAULT_BLOCKLINES):
+        super(ZoneMapBuilder, self).__init__()
+        self.paths = paths
+        self.parses = parses
+        self.blocklines = blocklines
+        self._src = None
+        self._fin = None
+
+    def _start(self, src):
+        """ Start building the zone maps of src
+        """
+        self._src = src
+        self._tracked = self._fin.get_position() is not None
+        self._nlines = 0
+        self._types = [set() for _ in self.paths]
+        self._blocks = [list() for _ in self.paths]
+
+    def _finish(self):
+        """ Write the zone maps of the current file if it is read without
+            errors.
+        """
+        if self._src is None:
+            return
+        if not self._tracked:
+            logging.warn('No zone map is built for %s which can not be indexed' % (self._src,))
+            self._src = None
+            return
+        if self._src in self._fin.failed:
+            logging.warn('No zone map is built for %s due to errors' % (self._src,))
+            return
+        stat = os.stat(self._src)
+        for path, types, blocks in zip(self.paths, self._types, self._blocks):
+            if len(types) > 1:
+                vtype = 'mixed'
+            elif types:
+                vtype = types.pop()
+            else:
+                vtype = None
+            zonemap = {'version': _VERSION, 'path': path, 'size': stat.st_size,
+                    'mtime': stat.st_mtime, 'nlines': self._nlines, 'type': vtype,
+                    'blocks': blocks}
+            tmppath = zonemap_path(self._src, path) + '.tmp'
+            with open(tmppath, 'w') as fout:
+                json.dump(zonemap, fout)
+            os.rename(tmppath, zonemap_path(self._src, path))
+        self._src = None
+
+    def add(self, fin, obj):
+        """ Add the values in obj, a line just read from fin
+        """
+        src = fin.get_current()
+        if src != self._src:
+            self._fin = fin
+            self._finish()
+            self._start(src)
+        if not self._tracked:
+            return
+        newblock = self._nlines % self.blocklines == 0
+        for i, parse in enumerate(self.parses):
+            if newblock:
+                member, offset = fin.get_position()
+                # first line, member, offset, lines, min, max, malformed lines
+                self._blocks[i].append([self._nlines, member, offset, 0, None, None, 0])
+            block = self._blocks[i][-1]
+            block[3] += 1
+            if obj is None:
+                block[6] += 1
+                continue
+            try:
+                val = parse(obj)
+            except (KeyError, IndexError, TypeError):
+                continue
+            self._types[i].add(value_type(val))
+            if block[4] is None or val < block[4]:
+                block[4] = val
+            if block[5] is None or val > block[5]:
+                block[5] = val
+        self._nlines += 1
+
+    def close(self, complete):
+        """ Write the zone maps of the last file if it is read completely
+        """
+        if complete:
+            self._finish()
+
+
+class ZoneMap(object):
+    """ A zone map loaded from its file, see ZoneMapBuilder
+    """
+    def __init__(self, src, zonemap):
+        super(ZoneMap, self).__init__()
+        self.src = src
+        self.path = zonemap['path']
+        self.nlines = zonemap['nlines']
+        self.type = zonemap['type']
+        self.blocks = zonemap['blocks']
+
+    @classmethod
+    def load(cls, src, path):
+        """ Load the zone map of src for path, or return None if there is no
+            zone map or it is out of date.
+        """
+        zpath = zonemap_path(src, path)
+        if not os.path.exists(zpath):
+            return None
+        with open(zpath) as fin:
+            zonemap = json.load(fin)
+        if zonemap.get('version') != _VERSION:
+            logging.warn('Unknown zone map format of %s' % (zpath,))
+            return None
+        stat = os.stat(src)
+        if stat.st_size != zonemap['size'] or stat.st_mtime != zonemap['mtime']:
+            logging.warn('Zone map %s is out of date, rebuild it with '
+                    '--build-zonemap' % (zpath,))
+            return None
+        return cls(src, zonemap)
+
+    def convert(self, refval):
+        """ Convert a REFVAL string to the type of the values, or return None
+            if the zone map can not be used with it.
+        """
+        try:
+            if self.type == 'int':
+                return int(refval)
+            elif self.type == 'float':
+                return float(refval)
+            elif self.type == 'str':
+                return unicode(refval)
+            elif self.type is None:
+                return refval
+        except (ValueError, UnicodeError):
+            pass
+        return None
+
+    def keep(self, oper, ispositive, refval):
+        """ Return a list telling whether each block may have lines
+            fulfilling the condition, or None if the zone map can not tell.
+        """
+        refval = self.convert(refval)
+        if refval is None:
+            return None
+        keeps = list()
+        for _, _, _, _, vmin, vmax, nbad in self.blocks:
+            if nbad > 0:
+                keeps.append(True)
+            elif vmin is None:
+                # lines without the element never fulfill the condition
+                keeps.append(False)
+            elif oper == '<=':
+                keeps.append(vmin <= refval if ispositive else vmax > refval)
+            elif oper == '>=':
+                keeps.append(vmax >= refval if ispositive else vmin < refval)
+            elif ispositive:
+                keeps.append(vmin <= refval <= vmax)
+            else:
+                keeps.append(not vmin == vmax == refval)
+        return keeps